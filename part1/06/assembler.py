@@ -1,4 +1,5 @@
 import sys, os
+import hackimage
 
 # C-instruction bits
 # 1 1 1 a c1 c2 c3 c4 c5 c6 d1 d2 d3 j1 j2 j3
@@ -11,66 +12,66 @@ import sys, os
 # a c1 c2 c3 c4 c5 c6
 compTable = {
   # Constants
-  "0":   "0101010",
-  "1":   "0111111",
-  "-1":  "0111010",
+  "0":   0b0101010,
+  "1":   0b0111111,
+  "-1":  0b0111010,
   # Single operand
-  "D":   "0001100",
-  "A":   "0110000",
-  "M":   "1110000",
-  "!D":  "0001101",
-  "!A":  "0110001",
-  "!M":  "1110001",
-  "-D":  "0001111",
-  "-A":  "0110011",
-  "-M":  "1110011",
-  "D+1": "0011111",
-  "A+1": "0110111",
-  "M+1": "1110111",
-  "D-1": "0001110",
-  "A-1": "0110010",
-  "M-1": "1110010",
+  "D":   0b0001100,
+  "A":   0b0110000,
+  "M":   0b1110000,
+  "!D":  0b0001101,
+  "!A":  0b0110001,
+  "!M":  0b1110001,
+  "-D":  0b0001111,
+  "-A":  0b0110011,
+  "-M":  0b1110011,
+  "D+1": 0b0011111,
+  "A+1": 0b0110111,
+  "M+1": 0b1110111,
+  "D-1": 0b0001110,
+  "A-1": 0b0110010,
+  "M-1": 0b1110010,
   # Binary operations
-  "D+A": "0000010",
-  "D+M": "1000010",
-  "D-A": "0010011",
-  "D-M": "1010011",
-  "A-D": "0000111",
-  "M-D": "1000111",
-  "D&A": "0000000",
-  "D&M": "1000000",
-  "D|A": "0010101",
-  "D|M": "1010101",
+  "D+A": 0b0000010,
+  "D+M": 0b1000010,
+  "D-A": 0b0010011,
+  "D-M": 0b1010011,
+  "A-D": 0b0000111,
+  "M-D": 0b1000111,
+  "D&A": 0b0000000,
+  "D&M": 0b1000000,
+  "D|A": 0b0010101,
+  "D|M": 0b1010101,
 };
 
 #destination field
 # d1 d2 d3
 destTable = {
-  "null":  "000", # no destination
-  "M":   "001",
-  "D":   "010",
-  "MD":  "011",
-  "A":   "100",
-  "AM":  "101",
-  "AD":  "110",
-  "AMD": "111",
+  "null":  0b000, # no destination
+  "M":   0b001,
+  "D":   0b010,
+  "MD":  0b011,
+  "A":   0b100,
+  "AM":  0b101,
+  "AD":  0b110,
+  "AMD": 0b111,
 };
 
 #jump field
 # j1 j2 j3
 jumpTable = {
-  "null":  "000", # no jump
-  "JGT": "001",
-  "JEQ": "010",
-  "JGE": "011",
-  "JLT": "100",
-  "JNE": "101",
-  "JLE": "110",
-  "JMP": "111",
+  "null":  0b000, # no jump
+  "JGT": 0b001,
+  "JEQ": 0b010,
+  "JGE": 0b011,
+  "JLT": 0b100,
+  "JNE": 0b101,
+  "JLE": 0b110,
+  "JMP": 0b111,
 };
 
 # pre-defined symbols used in assembly code
-table = {
+predefined = {
     "SP":0,
     "LCL":1,
     "ARG":2,
@@ -83,27 +84,21 @@ table = {
 # pre-defined Registers 
 for i in range(16):
     register = "R" + str(i)
-    table[register] = i
+    predefined[register] = i
 
 
 def strip(line):
     line = line.split("//")[0]
     return line.strip()
 
-# cursor to new variable
-newVar = 16
-# add new variable
-def addVar(var):
-
-    global newVar
-    table[var] = newVar
-    newVar+=1
-    return table[var]
+# field offsets inside a C-instruction word
+C_PREFIX = 0b111 << 13
+COMP_SHIFT = 6
+DEST_SHIFT = 3
 
 # translate c expressions to binary
 def cTranslate(line):
     translated = line.strip()
-    cbin = "111"
 
     # Split into dest and rest
     if "=" in translated:
@@ -117,67 +112,192 @@ def cTranslate(line):
     else:
         comp, jump = rest, "null"
 
-    # Build binary code
-    cbin += (
-        compTable.get(comp.strip(), "0000000")
-        + destTable.get(dest.strip(), "000")
-        + jumpTable.get(jump.strip(), "000")
+    # Build the word from the integer fields
+    return (
+        C_PREFIX
+        | compTable.get(comp.strip(), 0) << COMP_SHIFT
+        | destTable.get(dest.strip(), 0) << DEST_SHIFT
+        | jumpTable.get(jump.strip(), 0)
     )
-    return cbin + "\n"
 
+# C-instruction text -> word. Programs only use a few hundred distinct
+# spellings, so each one is split and encoded once per process.
+cCache = {}
 
 
-# translate a expression to binary
-def aTranslate(line):
-    symbol = line[1:].strip()
-    if symbol.isdigit():
-        val = int(symbol)
-    else:
-        val = table.get(symbol, -1)
-        if val == -1:
-            val = addVar(symbol)
-        else:
-            val = table[symbol]
-    abin = "0" + bin(val)[2:].zfill(15)
-    return abin + "\n"
-
-#python3 assembler.py [file_to_compile.asm] [name_of_compiled_file.hack]
-# get file to compile
-# Get full path of input file
-asm_path = sys.argv[1]
-
-# Get directory, base name, and stem
-base_name = os.path.splitext(os.path.basename(asm_path))[0]   
-dir_name = os.path.dirname(asm_path)                          
-tmp_path = os.path.join(dir_name, base_name + ".tmp")         
-hack_path = os.path.join(dir_name, base_name + ".hack")       
-
-# First pass
-def firstPass():
-    with open(asm_path) as inputFile, open(tmp_path, "w") as outputFile:
-        line_curs = 0
-        for l in inputFile:
-            stripped = strip(l)
-            if not stripped:
-                continue
-            if stripped[0] == "(":
-                label = stripped[1:-1]
-                table[label] = line_curs
-            else:
-                outputFile.write(stripped + "\n")
-                line_curs += 1
+# Structured instructions: an int is a finished word, ("@", symbol) an
+# A-instruction naming a symbol, ("(", label) a label declaration.
+def decode_line(line):
+    """
+    The structured instruction of one line, or None for a blank line.
+    """
+    stripped = strip(line)
+    if not stripped:
+        return None
+    if stripped[0] == "(":
+        return "(", stripped[1:-1]
+    if stripped[0] == "@":
+        symbol = stripped[1:].strip()
+        return int(symbol) if symbol.isdigit() else ("@", symbol)
+    word = cCache.get(stripped)
+    if word is None:
+        word = cCache[stripped] = cTranslate(stripped)
+    return word
+
+
+# Raw line -> decode_line(line). Generated assembly repeats the same
+# lines over and over; cleared when it grows past LINE_CACHE_SIZE.
+lineCache = {}
+LINE_CACHE_SIZE = 1 << 16
+
+
+def decode_lines(lines):
+    """
+    Yields the structured instructions of lines one at a time, so a
+    parse builds no item list.
+    """
+    cache = lineCache
+    for line in lines:
+        item = cache.get(line, line)
+        if item is line:
+            if len(cache) >= LINE_CACHE_SIZE:
+                cache.clear()
+            item = cache[line] = decode_line(line)
+        if item is not None:
+            yield item
+
+
+def decode(lines):
+    """
+    The structured instructions of lines, as a list.
+    """
+    return list(decode_lines(lines))
+
+
+# format assembled words as .hack text
+def toText(words):
+    return "".join([f"{w:016b}\n" for w in words])
 
 
-# Second pass
-def assemble():
-    with open(tmp_path) as inputFile, open(hack_path, "w") as outputFile:
-        for l in inputFile:
-            if l[0] == "@":
-                outputFile.write(aTranslate(l))
+class Assembler:
+    """
+    Translates Hack assembly into 16-bit machine words.
+    Symbol table and variable cursor belong to the instance, so one
+    process can assemble any number of programs without them leaking
+    into each other.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets every label and variable from the previous program.
+        """
+        self.table = dict(predefined)
+        self.newVar = 16  # cursor to new variable
+        self.code = []
+        self.pending = {}
+
+    def addVar(self, var):
+        """
+        Allocates the next free RAM address to a new variable.
+        """
+        self.table[var] = self.newVar
+        self.newVar += 1
+        return self.table[var]
+
+    def feed(self, items):
+        """
+        Appends structured instructions (see decode) to the program.
+        Single pass: A-instructions naming a symbol that is not known yet
+        are left as holes and back-patched when the label shows up.
+        """
+        table = self.table
+        code = self.code        # translated instructions, None where a symbol is pending
+        pending = self.pending  # symbol -> indices in code waiting for its address
+        for item in items:
+            if item.__class__ is int:
+                code.append(item)
+            elif item[0] == "@":
+                symbol = item[1]
+                if symbol in table:
+                    code.append(table[symbol])
+                else:
+                    pending.setdefault(symbol, []).append(len(code))
+                    code.append(None)
             else:
-                outputFile.write(cTranslate(l))
-    os.remove(tmp_path)
+                label = item[1]
+                table[label] = len(code)
+                for i in pending.pop(label, ()):
+                    code[i] = table[label]
+
+    def finish(self):
+        """
+        Ends the program: whatever is still pending was never declared
+        as a label and becomes a variable. Returns the words.
+        """
+        code = self.code
+        # never declared as a label -> new variable, in order of first use
+        for symbol, holes in self.pending.items():
+            val = self.addVar(symbol)
+            for i in holes:
+                code[i] = val
+        self.pending = {}
+        return code
 
+    def parse(self, lines):
+        """
+        Translates assembly lines in memory and returns the words.
+        """
+        self.feed(decode_lines(lines))
+        return self.finish()
 
-firstPass()
-assemble()
+    def assemble(self, text):
+        """
+        Assembles a whole program given as a string and returns its words.
+        """
+        self.reset()
+        return self.parse(text.splitlines())
+
+    def symbols(self):
+        """
+        Labels and variables of the last program (predefined ones excluded).
+        """
+        return {k: v for k, v in self.table.items() if k not in predefined}
+
+    def assemble_file(self, asm_path, hack_path=None, text=True, image=False, symbols=False):
+        """
+        Assembles asm_path and writes the .hack file next to it
+        (or to hack_path). With image=True a packed .hackbin image is
+        written alongside, optionally carrying the symbol table; text=False
+        skips the .hack file. Returns the assembled words.
+        """
+        stem = os.path.splitext(asm_path)[0]
+        if hack_path is None:
+            hack_path = stem + ".hack"
+        self.reset()
+        with open(asm_path) as inputFile:
+            code = self.parse(inputFile)
+        if text:
+            with open(hack_path, "w") as outputFile:
+                outputFile.write(toText(code))
+        if image:
+            bin_path = os.path.splitext(hack_path)[0] + hackimage.EXTENSION
+            hackimage.write_image(bin_path, code, self.symbols() if symbols else None)
+        return code
+
+
+#python3 assembler.py [file_to_compile.asm] [name_of_compiled_file.hack] [--bin] [--bin-only] [--symbols]
+#   --bin       also write a packed .hackbin image
+#   --bin-only  write the image instead of the .hack text
+#   --symbols   store the symbol table in the image
+if __name__ == "__main__":
+    flags = {a for a in sys.argv[1:] if a.startswith("--")}
+    paths = [a for a in sys.argv[1:] if not a.startswith("--")]
+    Assembler().assemble_file(
+        *paths[:2],
+        text="--bin-only" not in flags,
+        image=bool(flags & {"--bin", "--bin-only"}),
+        symbols="--symbols" in flags,
+    )
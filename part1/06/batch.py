@@ -0,0 +1,72 @@
+import sys, os, glob, time
+from concurrent.futures import ProcessPoolExecutor
+from assembler import Assembler
+
+#python3 batch.py <directory|glob> [workers]
+# Assembles every .asm file found across a process pool.
+# Each file gets its own Assembler, so symbol tables never mix.
+
+
+def collect(target):
+    """
+    Returns the sorted .asm files named by a directory (searched
+    recursively) or a glob pattern.
+    """
+    if os.path.isdir(target):
+        pattern = os.path.join(target, "**", "*.asm")
+    else:
+        pattern = target
+    return sorted(p for p in glob.glob(pattern, recursive=True) if p.endswith(".asm"))
+
+
+def assemble_one(asm_path):
+    """
+    Worker: assembles a single file.
+    Returns (path, number of words or None, seconds, error or None).
+    """
+    start = time.perf_counter()
+    try:
+        words = Assembler().assemble_file(asm_path)
+    except Exception as e:
+        return asm_path, None, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+    return asm_path, len(words), time.perf_counter() - start, None
+
+
+def assemble_all(paths, workers=None):
+    """
+    Assembles paths in parallel and returns the per-file results
+    in the same order as paths.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(assemble_one, paths, chunksize=max(1, len(paths) // 64)))
+
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python3 batch.py <directory|glob> [workers]")
+        return 1
+
+    paths = collect(sys.argv[1])
+    if not paths:
+        print(f"No .asm files found: {sys.argv[1]}")
+        return 1
+    workers = int(sys.argv[2]) if len(sys.argv) == 3 else None
+
+    start = time.perf_counter()
+    results = assemble_all(paths, workers)
+    total = time.perf_counter() - start
+
+    failed = 0
+    for path, size, seconds, error in results:
+        if error is None:
+            print(f"ok    {seconds * 1000:8.1f} ms  {size:6d} words  {path}")
+        else:
+            failed += 1
+            print(f"FAIL  {seconds * 1000:8.1f} ms  {path}: {error}")
+
+    print(f"{len(paths) - failed}/{len(paths)} assembled in {total:.2f} s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
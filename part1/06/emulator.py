@@ -0,0 +1,175 @@
+import sys, os, time
+from array import array
+import hackimage
+from assembler import Assembler, compTable, toText
+
+#python3 emulator.py <program.asm|program.hack|program.hackbin> [max_steps]
+# Runs a Hack program in-process and prints RAM[0..15] when it stops.
+
+RAM_SIZE = 32768
+ROM_SIZE = 32768
+SCREEN = 16384
+KBD = 24576
+
+# comp bits (a c1..c6) -> Python expression over D, A, M.
+# +/- results are wrapped back into signed 16 bits.
+COMP_EXPR = {}
+for mnemonic, bits in compTable.items():
+    expr = mnemonic.replace("!", "~")
+    if ("+" in expr or "-" in expr) and expr != "-1":
+        expr = f"(({expr}) + 0x8000 & 0xFFFF) - 0x8000"
+    COMP_EXPR[bits] = expr
+
+COMP_FN = {bits: eval(f"lambda D, A, M: {expr}") for bits, expr in COMP_EXPR.items()}
+
+# predecoded record for a tail loop like (END) @END 0;JMP.
+# Also fills ROM past the end of the program, unless halt loops run.
+HALT = None
+
+
+def read_program(path):
+    """
+    Returns the ROM words of an .asm, .hack or .hackbin file.
+    """
+    if path.endswith(hackimage.EXTENSION):
+        return list(hackimage.load_image(path)[0])
+    with open(path) as f:
+        text = f.read()
+    if path.endswith(".asm"):
+        return Assembler().assemble(text)
+    return [int(line, 2) for line in text.split()]
+
+
+def decode(word):
+    """
+    Splits a C-instruction into (comp bits, uses M, dest, jump).
+    """
+    comp = (word >> 6) & 0x7F
+    return comp, bool(comp & 0x40), (word >> 3) & 0x7, word & 0x7
+
+
+def is_halt(words, p):
+    """
+    True if ROM[p] starts an @p / 0;JMP loop with no side effects.
+    """
+    if p + 1 >= len(words) or words[p] != p:
+        return False
+    nxt = words[p + 1]
+    return nxt & 0x8000 and (nxt >> 3) & 0x7 == 0 and nxt & 0x7 == 0x7
+
+
+class Emulator:
+    """
+    Hack CPU emulator. ROM words are predecoded once into records
+    (an int for A-instructions, a tuple for C-instructions) and run by a
+    single dispatch loop over local A/D/PC registers and an array RAM.
+    """
+
+    def __init__(self, words=()):
+        self.ram = array("h", bytes(2 * RAM_SIZE))
+        self.load(words)
+
+    def load(self, words, halts=True):
+        """
+        Predecodes a program into ROM and resets the CPU.
+        halts=False runs halt loops and the empty ROM after the program
+        (@0) like the hardware does, for cycle-exact runs: pc wraps
+        around at the end of ROM.
+        """
+        if len(words) > ROM_SIZE:
+            raise ValueError(f"program has {len(words)} words, ROM holds {ROM_SIZE}")
+        self.words = list(words)
+        code = []
+        for i, word in enumerate(self.words):
+            if halts and is_halt(self.words, i):
+                code.append(HALT)
+            elif word & 0x8000 == 0:
+                code.append(word)
+            else:
+                comp, usesM, dest, jump = decode(word)
+                if comp not in COMP_FN:
+                    raise ValueError(f"invalid instruction {toText([word]).strip()} at ROM[{i}]")
+                code.append((COMP_FN[comp], usesM, dest, jump))
+        code.extend([HALT if halts else 0] * (ROM_SIZE - len(code)))
+        self.code = code
+        self.reset()
+
+    def load_file(self, path):
+        self.load(read_program(path))
+
+    def reset(self):
+        """
+        Clears the registers (RAM is left alone, like the hardware reset).
+        """
+        self.A = 0
+        self.D = 0
+        self.pc = 0
+        self.halted = False
+        self.steps = 0
+
+    def run(self, max_steps=10_000_000):
+        """
+        Executes until a halt loop is reached or max_steps instructions
+        have run. Returns the number of instructions executed.
+        """
+        code, ram = self.code, self.ram
+        A, D, pc = self.A, self.D, self.pc
+        n = 0
+        for n in range(max_steps):
+            inst = code[pc]
+            if inst.__class__ is int:
+                A = inst
+                pc = (pc + 1) & 0x7FFF
+            elif inst is HALT:
+                self.halted = True
+                break
+            else:
+                comp, usesM, dest, jump = inst
+                addr = A & 0x7FFF
+                out = comp(D, A, ram[addr] if usesM else 0)
+                if dest:
+                    if dest & 1:
+                        ram[addr] = out
+                    if dest & 2:
+                        D = out
+                    if dest & 4:
+                        A = out
+                if jump and jump & (4 if out < 0 else 2 if out == 0 else 1):
+                    pc = addr
+                else:
+                    pc = (pc + 1) & 0x7FFF
+        else:
+            n = max_steps
+
+        self.A, self.D, self.pc = A, D, pc
+        self.steps += n
+        return n
+
+    def step(self):
+        """
+        Executes a single instruction.
+        """
+        return self.run(1)
+
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python3 emulator.py <program.asm|program.hack|program.hackbin> [max_steps]")
+        return
+
+    emu = Emulator()
+    emu.load_file(sys.argv[1])
+    max_steps = int(sys.argv[2]) if len(sys.argv) == 3 else 10_000_000
+
+    start = time.perf_counter()
+    steps = emu.run(max_steps)
+    seconds = time.perf_counter() - start
+
+    state = "halted" if emu.halted else "step budget exhausted"
+    print(f"{os.path.basename(sys.argv[1])}: {state} after {steps} instructions "
+          f"({steps / max(seconds, 1e-9) / 1e6:.2f} M/s)")
+    print("RAM[0..15]:", list(emu.ram[:16]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import sys, struct
+from array import array
+
+# Packed ROM image (.hackbin)
+#---------------------------------------------
+# header   magic "HACK", version u16, flags u16, words u32, symbols u32
+# code     words x little-endian uint16
+# symbols  (optional) per entry: value u16, name length u16, name bytes
+#---------------------------------------------
+# All fields are little-endian. The header is 16 bytes so the code
+# section is aligned and can be viewed in place as uint16.
+
+MAGIC = b"HACK"
+VERSION = 1
+FLAG_SYMBOLS = 0x1
+HEADER = struct.Struct("<4sHHII")
+EXTENSION = ".hackbin"
+
+
+def pack(words, symbols=None):
+    """
+    Packs a list of 16-bit words (and an optional name -> value
+    symbol table) into image bytes.
+    """
+    code = array("H", words)
+    if sys.byteorder == "big":
+        code.byteswap()
+
+    section = bytearray()
+    if symbols:
+        for name, value in symbols.items():
+            raw = name.encode()
+            section += struct.pack("<HH", value, len(raw)) + raw
+
+    flags = FLAG_SYMBOLS if symbols else 0
+    header = HEADER.pack(MAGIC, VERSION, flags, len(code), len(symbols or ()))
+    return header + code.tobytes() + bytes(section)
+
+
+def write_image(path, words, symbols=None):
+    """
+    Writes words (and optional symbols) to path as a packed image.
+    """
+    with open(path, "wb") as f:
+        f.write(pack(words, symbols))
+
+
+def unpack(data):
+    """
+    Splits image bytes into (code, symbols). code is a uint16 memoryview
+    over data itself on little-endian hosts; symbols is a dict, empty
+    when the image carries no symbol section. A truncated image raises
+    ValueError.
+    """
+    if len(data) < HEADER.size:
+        raise ValueError("not a Hack ROM image")
+    magic, version, flags, count, nsyms = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a Hack ROM image")
+
+    start = HEADER.size
+    end = start + 2 * count
+    if len(data) < end:
+        raise ValueError(f"truncated Hack ROM image: {count} words declared, "
+                         f"{(len(data) - start) // 2} present")
+    code = memoryview(data)[start:end].cast("H")
+    if sys.byteorder == "big":
+        code = array("H", code)
+        code.byteswap()
+
+    symbols = {}
+    if flags & FLAG_SYMBOLS:
+        pos = end
+        for _ in range(nsyms):
+            if len(data) < pos + 4:
+                raise ValueError("truncated Hack ROM image: symbol table cut short")
+            value, length = struct.unpack_from("<HH", data, pos)
+            pos += 4
+            if len(data) < pos + length:
+                raise ValueError("truncated Hack ROM image: symbol table cut short")
+            symbols[bytes(data[pos:pos + length]).decode()] = value
+            pos += length
+    return code, symbols
+
+
+def load_image(path):
+    """
+    Reads an image file, see unpack().
+    """
+    with open(path, "rb") as f:
+        return unpack(f.read())
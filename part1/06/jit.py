@@ -0,0 +1,181 @@
+import sys, os, re, time
+from emulator import Emulator, COMP_EXPR, HALT, ROM_SIZE, decode, read_program
+
+#python3 jit.py [--check] <program.asm|program.hack|program.hackbin> [max_steps]
+# Same as emulator.py, but runs basic blocks compiled to Python functions.
+# --check runs the program on the interpreter too, with halt loops
+# predecoded and cycle-exact (load halts=False), and compares the states.
+
+# longest straight-line run compiled into one function
+MAX_BLOCK = 256
+
+# jump bits -> condition on the ALU output t
+JUMP_COND = {
+    0b001: "t > 0",
+    0b010: "t == 0",
+    0b011: "t >= 0",
+    0b100: "t < 0",
+    0b101: "t != 0",
+    0b110: "t <= 0",
+}
+
+REGISTER = re.compile(r"[ADM]")
+
+
+class JitEmulator(Emulator):
+    """
+    Hack CPU emulator that translates each basic block of ROM (straight-line
+    code up to and including the next jump) into one generated Python
+    function over local A/D registers and the RAM array. Functions are
+    compiled on first entry and cached by entry address.
+
+    ROM cannot be written by a Hack program, so cached blocks never need
+    invalidating. Computed jumps (A=M / 0;JMP) simply return their target
+    and go back through the cache; when the step budget would end inside
+    a block, the remaining steps run on the interpreter instead.
+    """
+
+    def reset(self):
+        super().reset()
+        self.blocks = [None] * ROM_SIZE
+
+    def compile_block(self, entry):
+        """
+        Generates the function for the block starting at entry.
+        Returns (function, number of instructions it executes).
+        ROM past the program holds @0 when halt loops run (see load).
+        """
+        words, code = self.words, self.code
+        body = []
+        aConst = None  # value of A when known at compile time
+        pc = entry
+        size = 0
+        while True:
+            if code[pc] is HALT or size == MAX_BLOCK:
+                body.append(f"return {pc}, A, D")
+                break
+            word = words[pc] if pc < len(words) else 0
+            pc = (pc + 1) & 0x7FFF
+            size += 1
+            if word & 0x8000 == 0:
+                body.append(f"A = {word}")
+                aConst = word
+                continue
+
+            comp, usesM, dest, jump = decode(word)
+            addr = "(A & 0x7FFF)" if aConst is None else str(aConst & 0x7FFF)
+            regs = {"A": "A" if aConst is None else str(aConst), "D": "D", "M": f"ram[{addr}]"}
+            expr = REGISTER.sub(lambda m: regs[m.group()], COMP_EXPR[comp])
+
+            # jump target is the A register before this instruction writes it
+            target = addr
+            if jump and dest & 4 and aConst is None:
+                body.append("tgt = A & 0x7FFF")
+                target = "tgt"
+
+            # chained assignment stores left to right: M, D, then A
+            stores = []
+            if dest & 1:
+                stores.append(f"ram[{addr}]")
+            if dest & 2:
+                stores.append("D")
+            if dest & 4:
+                stores.append("A")
+                aConst = None
+            if jump in JUMP_COND:
+                stores.append("t")
+            if stores:
+                body.append(" = ".join(stores) + " = " + expr)
+
+            if jump == 0b111:
+                body.append(f"return {target}, A, D")
+                break
+            if jump:
+                body.append(f"return ({target} if {JUMP_COND[jump]} else {pc}), A, D")
+                break
+
+        src = f"def block_{entry}(ram, A, D):\n" + "".join(f"    {line}\n" for line in body)
+        namespace = {}
+        exec(compile(src, f"<block {entry}>", "exec"), namespace)
+        return namespace[f"block_{entry}"], size
+
+    def run(self, max_steps=10_000_000):
+        """
+        Executes until a halt loop is reached or max_steps instructions
+        have run. Returns the number of instructions executed.
+        """
+        code, ram, blocks = self.code, self.ram, self.blocks
+        A, D, pc = self.A, self.D, self.pc
+        n = 0
+        while n < max_steps:
+            block = blocks[pc]
+            if block is None:
+                # like the interpreter, a halt is only seen with budget left
+                if code[pc] is HALT:
+                    self.halted = True
+                    break
+                block = blocks[pc] = self.compile_block(pc)
+            fn, size = block
+            if n + size > max_steps:
+                break
+            pc, A, D = fn(ram, A, D)
+            n += size
+
+        self.A, self.D, self.pc = A, D, pc
+        self.steps += n
+        if not self.halted and n < max_steps:
+            # budget ends inside a block: finish on the interpreter
+            n += super().run(max_steps - n)
+        return n
+
+
+def snapshot(emu):
+    return {"steps": emu.steps, "halted": emu.halted, "pc": emu.pc, "A": emu.A, "D": emu.D,
+            "RAM": emu.ram.tobytes()}
+
+
+def check(words, max_steps):
+    """
+    Runs words on the interpreter and on the JIT, in both load modes.
+    Returns a line per mode: "halts=... ok" or what differs.
+    """
+    lines = []
+    for halts in (True, False):
+        runs = []
+        for cls in (Emulator, JitEmulator):
+            emu = cls()
+            emu.load(words, halts=halts)
+            emu.run(max_steps)
+            runs.append(snapshot(emu))
+        diff = [key for key in runs[0] if runs[0][key] != runs[1][key]]
+        lines.append(f"halts={halts}: " + ("ok" if not diff else "differs in " + ", ".join(diff)))
+    return lines
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if arg != "--check"]
+    if len(args) not in (1, 2):
+        print("Usage: python3 jit.py [--check] <program.asm|program.hack|program.hackbin> [max_steps]")
+        return
+
+    max_steps = int(args[1]) if len(args) == 2 else 10_000_000
+    if "--check" in sys.argv:
+        for line in check(read_program(args[0]), max_steps):
+            print(line)
+        return
+
+    emu = JitEmulator()
+    emu.load_file(args[0])
+
+    start = time.perf_counter()
+    steps = emu.run(max_steps)
+    seconds = time.perf_counter() - start
+
+    state = "halted" if emu.halted else "step budget exhausted"
+    print(f"{os.path.basename(args[0])}: {state} after {steps} instructions "
+          f"({steps / max(seconds, 1e-9) / 1e6:.2f} M/s)")
+    print("RAM[0..15]:", list(emu.ram[:16]))
+
+
+if __name__ == "__main__":
+    main()
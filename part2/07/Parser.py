@@ -5,13 +5,29 @@ class Parser:
     Handles parsing of a single .vm file.
     Reads VM commands, removes comments/whitespace, and provides access to command parts.
     """
-    def __init__(self, file_path):  
+    def __init__(self, file_path, streaming=False):  
+        self.streaming = streaming
+        self.idx = 0  # Current line index
+        self.current_command = ""  
+        if streaming:
+            # Read lazily: only the next command is held in memory
+            self.lines = self._stream(file_path)
+            self.next_command = next(self.lines, None)
+            return
         # Read all lines, clean them, and filter out empty lines
         with open(file_path, "r") as file:
             self.lines = [self._clean_line(line) for line in file]  
         self.lines = [line for line in self.lines if line]
-        self.idx = 0  # Current line index
-        self.current_command = ""  
+
+    def _stream(self, file_path):
+        """
+        Generator over the cleaned, non-empty lines of the file.
+        """
+        with open(file_path, "r") as file:
+            for line in file:
+                line = self._clean_line(line)
+                if line:
+                    yield line
 
     def _clean_line(self, line):  
         """
@@ -26,6 +42,8 @@ class Parser:
         """
         Returns True if there are more commands in the input.
         """
+        if self.streaming:
+            return self.next_command is not None
         return self.idx < len(self.lines)
 
     def advance(self):
@@ -33,7 +51,12 @@ class Parser:
         Reads the next command and makes it the current command.
         Should be called only if hasMoreLines() is true.
         """
-        if self.hasMoreLines():  
+        if self.streaming:
+            if self.next_command is not None:
+                self.current_command = self.next_command
+                self.next_command = next(self.lines, None)
+                self.idx += 1
+        elif self.hasMoreLines():  
             self.current_command = self.lines[self.idx]
             self.idx += 1
 
@@ -8,15 +8,17 @@ def main():
     """
     Main entry point for the VM Translator.
     Expects a single .vm file as input, translates it to Hack assembly (.asm).
+    --stream reads the input lazily instead of loading it whole.
     """
-    if len(sys.argv) != 2:
-        print("Usage: python3 VMTranslator.py file_name.vm")
+    args = [arg for arg in sys.argv[1:] if arg != "--stream"]
+    if len(args) != 1:
+        print("Usage: python3 VMTranslator.py [--stream] file_name.vm")
         return
 
-    input_file = sys.argv[1]
+    input_file = args[0]
     output_file = os.path.splitext(input_file)[0] + ".asm"
 
-    parser = Parser(input_file)
+    parser = Parser(input_file, streaming="--stream" in sys.argv)
     codewriter = CodeWriter(output_file)
 
     while parser.hasMoreLines():
@@ -1,4 +1,7 @@
 from Parser import *
+from Fusion import BASES, fused_assembly, load_d, patterns_for
+from Peephole import Peephole
+from Sink import BatchedSink, open_sink
 import os
 
 
@@ -6,14 +9,33 @@ class CodeWriter:
     """
     Translates VM commands into Hack assembly code and writes to the output file.
     Supports arithmetic, memory access, branching, functions, calls, and returns.
+    The output may be a file path, an open file, a list of chunks or a
+    callback (see Sink.py); batch_size > 0 joins chunks into larger writes.
     """
 
-    def __init__(self, file_name):
-        # Open the output .asm file for writing
-        self.file = open(file_name, "w")
+    def __init__(self, file_name, optimize=False, shared_calls=False, shared_compare=False, batch_size=0, fuse=False, cache_top=False, fold=False):
+        # Open the output .asm file for writing (or wrap the given sink)
+        self.sink, self.owns_sink = open_sink(file_name)
+        self.file = self.sink
+        if batch_size:
+            self.file = BatchedSink(self.file, batch_size)
+        self.peephole = None
+        if optimize:
+            # Route everything through the peephole optimizer
+            self.peephole = self.file = Peephole(self.file)
         self.label_counter = 0  # Used for generating unique labels in comparison commands
+        self.fragment = False  # Mark label numbers for relabeling (parallel translation)
         self.file_name = file_name  # Used for static variable naming
         self.current_function = ""  # Track current function for label scoping
+        self.shared_calls = shared_calls  # Jump to one global call/return routine
+        self.shared_compare = shared_compare  # Jump to one global routine per eq/gt/lt
+        self.used_routines = set()  # Shared routines to emit on close
+        self.templates = {}  # push/pop assembly by (command, segment, idx, file)
+        # Superinstruction patterns that keep this mode's semantics (see Fusion.py)
+        self.fusion_patterns = patterns_for(shared_calls, shared_compare, cache_top) if fuse else None
+        self.cache_top = cache_top  # Keep the top of the stack in D between commands
+        self.top_in_d = False  # The top of the stack is in D, not yet stored at RAM[SP]
+        self.fold = fold  # Fold constants and drop dead code first (see VMOptimizer.py)
 
     def writeInit(self):
         """
@@ -34,6 +56,13 @@ M=D
         Writes assembly code for arithmetic and logical VM commands.
         Handles: add, sub, neg, and, or, not, eq, gt, lt
         """
+        if self.cache_top:
+            if not (self.shared_compare and command in ("eq", "gt", "lt")):
+                self._writeArithmeticCached(command)
+                return
+            # The shared routines expect both operands on the stack
+            self.spillTop()
+
         if command == "add":
             # Pop two values, add, push result
             self.write(
@@ -89,13 +118,20 @@ M=D
         Writes assembly code for push and pop VM commands.
         Dispatches to the appropriate helper based on segment type.
         """
-        asm = None
-        if segment in ("constant", "temp"):
-            asm = self._write_cons_temp(command, segment, idx)
-        elif segment in ("static", "pointer"):
-            asm = self._write_pointer_static(command, segment, idx)
-        elif segment in ("local", "argument", "this", "that"):
-            asm = self._write_lcl_arg(command, segment, idx)
+        if self.cache_top:
+            self._writePushPopCached(command, segment, idx)
+            return
+        # Same command, same text: build each template once
+        key = (command, segment, idx, self.filename if segment == "static" else "")
+        asm = self.templates.get(key)
+        if asm is None:
+            if segment in ("constant", "temp"):
+                asm = self._write_cons_temp(command, segment, idx)
+            elif segment in ("static", "pointer"):
+                asm = self._write_pointer_static(command, segment, idx)
+            elif segment in ("local", "argument", "this", "that"):
+                asm = self._write_lcl_arg(command, segment, idx)
+            self.templates[key] = asm
         self.write(asm)
 
     def writeLabel(self, label):
@@ -103,6 +139,7 @@ M=D
         Writes assembly code for VM label command.
         Uses function scoping for Project 8 compatibility.
         """
+        self.spillTop()
         if self.current_function:
             full_label = f"{self.current_function}${label}"
         else:
@@ -113,6 +150,7 @@ M=D
         """
         Writes assembly code for VM goto command.
         """
+        self.spillTop()
         if label.count('.') > 0:  # If it's a function name (has dots)
             full_label = label
         elif self.current_function:
@@ -130,6 +168,11 @@ M=D
             full_label = f"{self.current_function}${label}"
         else:
             full_label = label
+        if self.top_in_d:
+            # The value is already in D
+            self.top_in_d = False
+            self.write(f"//if-goto {label}\n@{full_label}\nD;JNE\n")
+            return
         self.write(f"//if-goto {label}\n@SP\nAM=M-1\nD=M\n@{full_label}\nD;JNE\n")
 
     def writeFunction(self, funName, nVars):
@@ -137,6 +180,7 @@ M=D
         Writes assembly code for VM function command.
         Sets up function label and initializes local variables to 0.
         """
+        self.spillTop()
         self.current_function = funName  # Track current function for label scoping
         self.write(f"// function {funName} {nVars}\n")
         self.write(f"({funName})\n")
@@ -152,11 +196,31 @@ M=D
         Implements the full calling convention: save caller frame,
         set up new frame, transfer control.
         """
-        return_addr_label = f"RETURN_{funName}_{self.label_counter}"
-        self.label_counter += 1
+        self.spillTop()
+        return_addr_label = f"RETURN_{funName}_{self._nextLabelId()}"
         
         self.write(f"// call {funName} {nArgs}\n")
-        
+
+        if self.shared_calls:
+            # nArgs in R13, return address in R14, callee in D
+            self.used_routines.add("CALL")
+            self.write(
+                f"@{nArgs}\n"
+                "D=A\n"
+                "@R13\n"
+                "M=D\n"
+                f"@{return_addr_label}\n"
+                "D=A\n"
+                "@R14\n"
+                "M=D\n"
+                f"@{funName}\n"
+                "D=A\n"
+                "@$CALL\n"
+                "0;JMP\n"
+                f"({return_addr_label})\n"
+            )
+            return
+
         # Push return address
         retAddr = self._writeReturnAddr(return_addr_label)
         self.write(retAddr)
@@ -184,8 +248,59 @@ M=D
         Implements the full return convention: restore caller frame,
         position return value, transfer control back.
         """
-        asm = """// return
-@LCL
+        self.spillTop()
+        if self.shared_calls:
+            self.used_routines.add("RETURN")
+            self.write("// return\n@$RETURN\n0;JMP\n")
+            return
+        self.write("// return\n" + self._returnSequence())
+
+    def writeFused(self, name, commands):
+        """
+        Writes the hand-tuned assembly of a fused command sequence.
+        """
+        self.spillTop()
+        self.write(fused_assembly(self, name, commands))
+
+    def setFileName(self, file_path):
+        """
+        Sets the current file name for static variable naming.
+        Used when processing multiple .vm files in Project 8.
+        """
+        self.spillTop()
+        self.filename = os.path.splitext(os.path.basename(file_path))[0]
+        self.write(f"// File: {self.filename}\n")
+
+    def spillTop(self):
+        """
+        In cache_top mode, stores a stack top held in D at RAM[SP].
+        Needed wherever control can arrive from elsewhere (labels,
+        functions, return addresses) or leave (jumps, calls, returns),
+        so the stack is always entirely in RAM there.
+        """
+        if self.top_in_d:
+            self.top_in_d = False
+            self.write("@SP\nM=M+1\nA=M-1\nM=D\n")
+
+# ====== Helper functions below ======
+
+    def _nextLabelId(self):
+        """
+        Returns a fresh number for generated labels. In fragment mode the
+        number is wrapped in NUL markers so the merge can shift it past
+        the labels used by earlier files.
+        """
+        label_id = self.label_counter
+        self.label_counter += 1
+        return f"\0{label_id}\0" if self.fragment else str(label_id)
+
+    def _returnSequence(self, load_value="@SP\nAM=M-1\nD=M\n"):
+        """
+        Full return convention: restore caller frame, position return
+        value, jump to the return address.
+        load_value sets D to the return value (by default it is popped).
+        """
+        asm = """@LCL
 D=M
 @R13
 M=D
@@ -194,10 +309,7 @@ A=D-A
 D=M
 @R14
 M=D
-@SP
-AM=M-1
-D=M
-@ARG
+""" + load_value + """@ARG
 A=M
 M=D
 @ARG
@@ -214,27 +326,160 @@ M=D
         gotoReturnAddr = "@R14\nA=M\n0;JMP\n"
         asm += gotoReturnAddr
         
-        self.write(asm)
+        return asm
 
-    def setFileName(self, file_path):
+    def _sharedCallRoutine(self):
         """
-        Sets the current file name for static variable naming.
-        Used when processing multiple .vm files in Project 8.
+        Global call routine used in shared_calls mode.
+        Expects callee address in D, nArgs in R13, return address in R14.
         """
-        self.filename = os.path.splitext(os.path.basename(file_path))[0]
-        self.write(f"// File: {self.filename}\n")
+        asm = (
+            "// shared call routine\n"
+            "($CALL)\n"
+            "@R15\n"
+            "M=D\n"
+            "// push return address\n"
+            "@R14\n"
+            "D=M\n"
+            "@SP\n"
+            "A=M\n"
+            "M=D\n"
+            "@SP\n"
+            "M=M+1\n"
+        )
+        for segment in ["LCL", "ARG", "THIS", "THAT"]:
+            asm += self._savedCallerFrame(segment)
+        asm += (
+            "// ARG = SP - nArgs - 5\n"
+            "@SP\n"
+            "D=M\n"
+            "@R13\n"
+            "D=D-M\n"
+            "@5\n"
+            "D=D-A\n"
+            "@ARG\n"
+            "M=D\n"
+        )
+        asm += self._repositiningLCL()
+        asm += "@R15\nA=M\n0;JMP\n"
+        return asm
 
-# ====== Helper functions below ======
+    def _sharedComparisonRoutine(self, command):
+        """
+        Global routine for eq, gt or lt used in shared_compare mode.
+        Expects the return address in D. gt/lt only subtract when x and y
+        have the same sign, so x - y cannot overflow 16 bits.
+        """
+        name = command.upper()
+        asm = (
+            f"// shared {command} routine\n"
+            f"(${name})\n"
+            "@R15\n"
+            "M=D\n"
+            "@SP\n"
+            "AM=M-1\n"
+            "D=M\n"
+        )
+        if command == "eq":
+            return asm + (
+                "A=A-1\n"
+                "D=M-D\n"
+                "@$CMP_TRUE\n"
+                "D;JEQ\n"
+                "@$CMP_FALSE\n"
+                "0;JMP\n"
+            )
+
+        # Result when the signs differ is decided by the sign of x
+        x_pos = "TRUE" if command == "gt" else "FALSE"
+        x_neg = "FALSE" if command == "gt" else "TRUE"
+        jump = {"gt": "JGT", "lt": "JLT"}[command]
+        return asm + (
+            "@R13\n"
+            "M=D\n"
+            "@SP\n"
+            "A=M-1\n"
+            "D=M\n"
+            f"@${name}_XNEG\n"
+            "D;JLT\n"
+            "// x >= 0\n"
+            "@R13\n"
+            "D=M\n"
+            f"@${name}_SAME\n"
+            "D;JGE\n"
+            f"@$CMP_{x_pos}\n"
+            "0;JMP\n"
+            "// x < 0\n"
+            f"(${name}_XNEG)\n"
+            "@R13\n"
+            "D=M\n"
+            f"@${name}_SAME\n"
+            "D;JLT\n"
+            f"@$CMP_{x_neg}\n"
+            "0;JMP\n"
+            "// same sign, x - y cannot overflow\n"
+            f"(${name}_SAME)\n"
+            "@R13\n"
+            "D=M\n"
+            "@SP\n"
+            "A=M-1\n"
+            "D=M-D\n"
+            "@$CMP_TRUE\n"
+            f"D;{jump}\n"
+            "@$CMP_FALSE\n"
+            "0;JMP\n"
+        )
+
+    def _sharedComparisonTail(self):
+        """
+        Common end of the shared comparison routines: writes the result
+        over x and jumps back to the address saved in R15.
+        """
+        return (
+            "($CMP_TRUE)\n"
+            "D=-1\n"
+            "@$CMP_END\n"
+            "0;JMP\n"
+            "($CMP_FALSE)\n"
+            "D=0\n"
+            "($CMP_END)\n"
+            "@SP\n"
+            "A=M-1\n"
+            "M=D\n"
+            "@R15\n"
+            "A=M\n"
+            "0;JMP\n"
+        )
+
+    def _sharedReturnRoutine(self):
+        """
+        Global return routine used in shared_calls mode.
+        """
+        return "// shared return routine\n($RETURN)\n" + self._returnSequence()
 
     def _write_comparison(self, command):
         """
         Writes assembly code for comparison commands: eq, gt, lt.
         Uses unique labels for branching to avoid conflicts.
         """
+        if self.shared_compare:
+            # Return address in D, the routine leaves the result on the stack
+            label_return = f"{command.upper()}_RET_{self._nextLabelId()}"
+            self.used_routines.add(command.upper())
+            self.write(
+                f"//{command}\n"
+                f"@{label_return}\n"
+                "D=A\n"
+                f"@${command.upper()}\n"
+                "0;JMP\n"
+                f"({label_return})\n"
+            )
+            return
+
         jump = {"eq": "JEQ", "gt": "JGT", "lt": "JLT"}[command]
-        label_true = f"{command.upper()}_TRUE_{self.label_counter}"  
-        label_end = f"{command.upper()}_END_{self.label_counter}"    
-        self.label_counter += 1
+        label_id = self._nextLabelId()
+        label_true = f"{command.upper()}_TRUE_{label_id}"  
+        label_end = f"{command.upper()}_END_{label_id}"    
 
         asm = f"""//{command}
 @SP
@@ -264,6 +509,89 @@ M=M+1
 """
         self.write(asm)
 
+    def _writeArithmeticCached(self, command):
+        """
+        cache_top mode: takes y (the top) from D when it is there and
+        leaves the result in D instead of storing it.
+        """
+        pop_y = "" if self.top_in_d else "@SP\nAM=M-1\nD=M\n"
+        if command in ("neg", "not"):
+            if self.top_in_d:
+                asm = "D=-D\n" if command == "neg" else "D=!D\n"
+            else:
+                asm = "@SP\nAM=M-1\n" + ("D=-M\n" if command == "neg" else "D=!M\n")
+        elif command in ("eq", "gt", "lt"):
+            jump = {"eq": "JEQ", "gt": "JGT", "lt": "JLT"}[command]
+            label_id = self._nextLabelId()
+            label_true = f"{command.upper()}_TRUE_{label_id}"
+            label_end = f"{command.upper()}_END_{label_id}"
+            asm = (
+                pop_y
+                + "@SP\nAM=M-1\nD=M-D\n"
+                f"@{label_true}\n"
+                f"D;{jump}\n"
+                "D=0\n"
+                f"@{label_end}\n"
+                "0;JMP\n"
+                f"({label_true})\n"
+                "D=-1\n"
+                f"({label_end})\n"
+            )
+        else:
+            compute = {"add": "D=D+M", "sub": "D=M-D", "and": "D=D&M", "or": "D=D|M"}[command]
+            asm = pop_y + f"@SP\nAM=M-1\n{compute}\n"
+        self.top_in_d = True
+        self.write(f"//{command}\n" + asm)
+
+    def _writePushPopCached(self, command, segment, idx):
+        """
+        cache_top mode: push loads the value into D, leaving the previous
+        top on the stack; pop stores D directly when the top is there.
+        """
+        if command == "push":
+            self.spillTop()
+            key = ("load", segment, idx, self.filename if segment == "static" else "")
+            asm = self.templates.get(key)
+            if asm is None:
+                asm = self.templates[key] = f"//push {segment} {idx}\n" + load_d(self, segment, idx)
+            self.write(asm)
+            self.top_in_d = True
+            return
+
+        key = (("store" if self.top_in_d else "pop"), segment, idx,
+               self.filename if segment == "static" else "")
+        asm = self.templates.get(key)
+        if asm is None:
+            if not self.top_in_d:
+                asm = self._write_pop(segment, idx)
+            elif segment in BASES:
+                # D holds the value, so the address goes through R13/R14
+                asm = (
+                    f"//pop {segment} {idx}\n"
+                    "@R13\nM=D\n"
+                    f"@{idx}\nD=A\n@{BASES[segment]}\nD=D+M\n@R14\nM=D\n"
+                    "@R13\nD=M\n@R14\nA=M\nM=D\n"
+                )
+            elif segment == "temp":
+                asm = f"//pop temp {idx}\n@{5 + idx}\nM=D\n"
+            else:
+                # static or pointer
+                symbol = f"{self.filename}.{idx}" if segment == "static" else ("THIS" if idx == 0 else "THAT")
+                asm = f"//pop {segment} {idx}\n@{symbol}\nM=D\n"
+            self.templates[key] = asm
+        self.top_in_d = False
+        self.write(asm)
+
+    def _write_pop(self, segment, idx):
+        """
+        pop template of any segment.
+        """
+        if segment == "temp":
+            return self._write_cons_temp("pop", segment, idx)
+        if segment in ("static", "pointer"):
+            return self._write_pointer_static("pop", segment, idx)
+        return self._write_lcl_arg("pop", segment, idx)
+
     def _write_cons_temp(self, command, segment, idx):
         """
         Handles push/pop for constant and temp segments.
@@ -474,12 +802,26 @@ M=M+1
     
     def close(self):
         """
-        Writes an infinite loop at the end of the file and closes it.
+        Writes an infinite loop at the end of the file, flushes the output
+        and closes it if CodeWriter opened it.
         This prevents the program from executing random memory after completion.
         """
+        self.spillTop()
         self.file.write(
             "\n(INFINITE_LOOP)\n"
             "@INFINITE_LOOP\n"
             "0;JMP\n"
         )
-        self.file.close()
\ No newline at end of file
+        # Shared routines sit after the loop, reachable only by jumps
+        if "CALL" in self.used_routines:
+            self.write(self._sharedCallRoutine())
+        if "RETURN" in self.used_routines:
+            self.write(self._sharedReturnRoutine())
+        compare = [c for c in ("eq", "gt", "lt") if c.upper() in self.used_routines]
+        for command in compare:
+            self.write(self._sharedComparisonRoutine(command))
+        if compare:
+            self.write(self._sharedComparisonTail())
+        self.file.flush()
+        if self.owns_sink:
+            self.sink.close()
\ No newline at end of file
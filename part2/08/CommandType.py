@@ -19,4 +19,7 @@ C_IF = "if-goto"               # Conditional jump
 # Function commands
 C_FUNCTION = "function"        # Function declaration
 C_RETURN = "return"            # Return from function
-C_CALL = "call"                # Function call
\ No newline at end of file
+C_CALL = "call"                # Function call
+
+# Integer opcodes: index of each command type in this tuple
+COMMAND_TYPES = (C_ARITHMETIC, C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, C_FUNCTION, C_RETURN, C_CALL)
@@ -0,0 +1,368 @@
+"""
+DiffTest.py
+
+Differential testing of the translator: every program runs once in the
+VM interpreter (VMEmulator.py), which follows the VM semantics directly,
+and once per code generation mode through translate -> assemble -> Hack
+emulator (Pipeline.build and part1/06). Their end states must agree.
+
+Programs are the project 7/8 tests (compared on the RAM cells their .tst
+outputs) and randomly generated ones: a Sys.vm calling functions of a
+Gen.vm with arithmetic, all segments, branches, loops and calls. Those
+run until both halt and are compared on the registers, temp, statics,
+the live stack and the heap. Cases run in parallel across cores.
+
+    python3 DiffTest.py [-n CASES] [--seed S] [-j WORKERS] [--overflow] [flags...]
+    python3 DiffTest.py --dump SEED
+
+Without flags every mode in MODES is checked. Generated comparisons mask
+their operands to 0..1023, since the inline eq/gt/lt templates subtract
+without overflow checks; --overflow drops the masks (only -C is safe).
+"""
+import sys
+import os
+import io
+import re
+import glob
+import random
+import tempfile
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from VMEmulator import VMEmulator
+from VMTranslator import OPTION_FLAGS, options_from_flags
+from Pipeline import build
+from emulator import Emulator  # part1/06, put on the path by Pipeline
+from CommandType import *
+
+MODES = ["", "-O", "-S", "-C", "-F", "-D", "--fold", "-O -S -C -F -D --fold --prune"]
+TESTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "nand2tetris", "projects")
+
+VM_STEPS = 2_000_000
+HACK_STEPS = 50_000_000
+
+THIS_BASE = 3000
+THAT_BASE = 3100
+VARS = 4       # locals a statement may assign
+COUNTERS = 3   # locals after those, one loop counter per nesting level
+SEGMENT_SIZE = 8  # static, temp, this and that indices used
+
+
+# ====== Random programs ======
+
+class ProgramGenerator:
+    """
+    Builds a random, always terminating VM program from a seed.
+    Functions only call functions generated before them, and loop
+    counters are locals that the loop body never assigns.
+    """
+
+    def __init__(self, seed, overflow=False):
+        self.rng = random.Random(seed)
+        self.overflow = overflow
+        self.label_count = 0
+
+    def constant(self):
+        rng = self.rng
+        return rng.choice((0, 1, 2, rng.randrange(256), rng.randrange(32768)))
+
+    def leaf(self, out, n_args):
+        rng = self.rng
+        segment = rng.choice(("constant", "constant", "local", "argument", "static",
+                              "temp", "this", "that", "pointer"))
+        if segment == "constant":
+            idx = self.constant()
+        elif segment == "local":
+            idx = rng.randrange(VARS + COUNTERS)
+        elif segment == "argument":
+            if not n_args:
+                return self.leaf(out, n_args)
+            idx = rng.randrange(n_args)
+        elif segment == "pointer":
+            idx = rng.randrange(2)
+        else:
+            idx = rng.randrange(SEGMENT_SIZE)
+        out.append((C_PUSH, segment, idx))
+
+    def expression(self, out, n_args, depth=3):
+        """
+        Appends commands that push one value.
+        """
+        rng = self.rng
+        if depth == 0 or rng.random() < 0.3:
+            self.leaf(out, n_args)
+            return
+        kind = rng.random()
+        if kind < 0.5:
+            self.expression(out, n_args, depth - 1)
+            self.expression(out, n_args, depth - 1)
+            out.append((C_ARITHMETIC, rng.choice(("add", "sub", "and", "or")), None))
+        elif kind < 0.7:
+            self.expression(out, n_args, depth - 1)
+            out.append((C_ARITHMETIC, rng.choice(("neg", "not")), None))
+        else:
+            for _ in range(2):
+                self.expression(out, n_args, depth - 1)
+                if not self.overflow:
+                    out += [(C_PUSH, "constant", 1023), (C_ARITHMETIC, "and", None)]
+            out.append((C_ARITHMETIC, rng.choice(("eq", "gt", "lt")), None))
+
+    def destination(self, n_args):
+        rng = self.rng
+        segment = rng.choice(("local", "local", "argument", "static", "temp", "this", "that"))
+        if segment == "argument" and not n_args:
+            segment = "local"
+        if segment == "local":
+            return (C_POP, segment, rng.randrange(VARS))
+        if segment == "argument":
+            return (C_POP, segment, rng.randrange(n_args))
+        return (C_POP, segment, rng.randrange(SEGMENT_SIZE))
+
+    def label(self):
+        self.label_count += 1
+        return f"L{self.label_count}"
+
+    def call(self, out, n_args, callees):
+        name, callee_args = self.rng.choice(callees)
+        for _ in range(callee_args):
+            self.expression(out, n_args, 2)
+        out.append((C_CALL, name, callee_args))
+
+    def statements(self, out, n_args, callees, depth=0, count=4):
+        rng = self.rng
+        for _ in range(rng.randint(1, count)):
+            kind = rng.random()
+            if kind < 0.45 or depth >= COUNTERS:
+                self.expression(out, n_args)
+                out.append(self.destination(n_args))
+            elif kind < 0.65:
+                then_label, end_label = self.label(), self.label()
+                self.expression(out, n_args)
+                out.append((C_IF, then_label, None))
+                self.statements(out, n_args, callees, depth + 1, 2)
+                out.append((C_GOTO, end_label, None))
+                out.append((C_LABEL, then_label, None))
+                self.statements(out, n_args, callees, depth + 1, 2)
+                out.append((C_LABEL, end_label, None))
+            elif kind < 0.8:
+                counter = VARS + depth
+                loop_label = self.label()
+                out += [(C_PUSH, "constant", rng.randint(1, 4)), (C_POP, "local", counter),
+                        (C_LABEL, loop_label, None)]
+                self.statements(out, n_args, callees, depth + 1, 2)
+                out += [(C_PUSH, "local", counter), (C_PUSH, "constant", 1),
+                        (C_ARITHMETIC, "sub", None), (C_POP, "local", counter),
+                        (C_PUSH, "local", counter), (C_IF, loop_label, None)]
+            elif callees:
+                self.call(out, n_args, callees)
+                out.append(self.destination(n_args))
+
+    def generate(self):
+        """
+        Returns {file name: commands}.
+        """
+        rng = self.rng
+        functions = []
+        gen = []
+        for k in range(rng.randint(1, 5)):
+            name, n_args = f"Gen.f{k}", rng.randrange(4)
+            gen.append((C_FUNCTION, name, VARS + COUNTERS))
+            self.statements(gen, n_args, functions)
+            self.expression(gen, n_args)
+            gen.append((C_RETURN, None, None))
+            functions.append((name, n_args))
+
+        sys_vm = [
+            (C_FUNCTION, "Sys.init", VARS + COUNTERS),
+            (C_PUSH, "constant", THIS_BASE), (C_POP, "pointer", 0),
+            (C_PUSH, "constant", THAT_BASE), (C_POP, "pointer", 1),
+        ]
+        for _ in range(rng.randint(1, 4)):
+            self.call(sys_vm, 0, functions)
+            sys_vm.append((C_POP, "static", rng.randrange(SEGMENT_SIZE)))
+        sys_vm += [(C_LABEL, "END", None), (C_GOTO, "END", None)]
+        return {"Sys.vm": sys_vm, "Gen.vm": gen}
+
+
+def to_text(commands):
+    """
+    VM source of commands.
+    """
+    lines = []
+    for ctype, arg1, arg2 in commands:
+        if ctype == C_ARITHMETIC:
+            lines.append(arg1)
+        elif ctype == C_RETURN:
+            lines.append(ctype)
+        elif arg2 is None:
+            lines.append(f"{ctype} {arg1}")
+        else:
+            lines.append(f"{ctype} {arg1} {arg2}")
+    return "\n".join(lines) + "\n"
+
+
+# ====== Running both sides ======
+
+def run_vm(vm_files, ram_settings=(), max_steps=VM_STEPS):
+    vm = VMEmulator(natives=False)
+    vm.load_files(vm_files)
+    for address, value in ram_settings:
+        vm.ram[address] = value
+    vm.run(max_steps)
+    return vm
+
+
+def run_hack(vm_files, flags, ram_settings=(), max_steps=HACK_STEPS):
+    """
+    Returns the Hack emulator after the run and the program's symbols.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        words, assembler = build(vm_files, **options_from_flags(flags.split()))
+    cpu = Emulator(words)
+    for address, value in ram_settings:
+        cpu.ram[address] = value
+    cpu.run(max_steps)
+    return cpu, assembler.symbols()
+
+
+def compared_cells(sp):
+    """
+    RAM compared after a generated program: SP/LCL/ARG/THIS/THAT, temp,
+    the stack up to SP without the bootstrap's return address (a command
+    index on one side, a ROM address on the other) and the this/that
+    area. R13-R15 and RAM above SP are the translator's scratch.
+    """
+    return (list(range(0, 13)) + list(range(257, sp))
+            + list(range(THIS_BASE, THAT_BASE + 2 * SEGMENT_SIZE)))
+
+
+def first_difference(cells, vm_ram, hack_ram):
+    for address in cells:
+        if vm_ram[address] != hack_ram[address]:
+            return f"RAM[{address}]: VM {vm_ram[address]}, Hack {hack_ram[address]}"
+    return None
+
+
+def static_difference(vm, hack_ram, symbols):
+    """
+    Compares static variables by name: their addresses follow the order
+    of first use in the code, which optimizations may change. A static
+    the translated program no longer uses must have stayed 0.
+    """
+    for (file_name, idx), address in vm.statics.items():
+        name = f"{file_name}.{idx}"
+        value = hack_ram[symbols[name]] if name in symbols else 0
+        if vm.ram[address] != value:
+            return f"{name}: VM {vm.ram[address]}, Hack {value}"
+    return None
+
+
+def check_generated(seed, modes, overflow=False):
+    """
+    Worker: runs generated program seed in the VM and in every mode.
+    Returns [(mode, problem)] for the modes that disagree.
+    """
+    files = ProgramGenerator(seed, overflow).generate()
+    problems = []
+    with tempfile.TemporaryDirectory() as directory:
+        vm_files = []
+        for name, commands in files.items():
+            path = os.path.join(directory, name)
+            with open(path, "w") as file:
+                file.write(to_text(commands))
+            vm_files.append(path)
+
+        vm = run_vm(vm_files)
+        if not vm.halted:
+            return [("", f"VM did not halt in {VM_STEPS} commands")]
+        cells = compared_cells(vm.ram[0])
+        for mode in modes:
+            cpu, symbols = run_hack(vm_files, mode)
+            if not cpu.halted:
+                problems.append((mode, f"Hack program did not halt in {HACK_STEPS} instructions"))
+                continue
+            difference = (first_difference(cells, vm.ram, cpu.ram)
+                          or static_difference(vm, cpu.ram, symbols))
+            if difference:
+                problems.append((mode, difference))
+    return problems
+
+
+def read_test(tst_path):
+    """
+    (RAM settings, repeat count, output cells) of a project 7/8 .tst.
+    """
+    with open(tst_path) as file:
+        text = re.sub(r"//.*", "", file.read())
+    settings = [(int(a), int(v)) for a, v in re.findall(r"set RAM\[(\d+)\]\s+(-?\d+)", text)]
+    repeat = re.search(r"repeat\s+(\d+)", text)
+    cells = [int(a) for a in re.findall(r"RAM\[(\d+)\]%", text)]
+    return settings, int(repeat.group(1)) if repeat else HACK_STEPS, cells
+
+
+def check_test(tst_path, modes):
+    """
+    Worker: runs one project test in the VM and in every mode and
+    compares the cells the test outputs. The Hack side gets the test's
+    own instruction budget, since some tests never halt.
+    """
+    vm_files = glob.glob(os.path.join(os.path.dirname(tst_path), "*.vm"))
+    settings, repeat, cells = read_test(tst_path)
+    vm = run_vm(vm_files, settings)
+    problems = []
+    for mode in modes:
+        cpu, _ = run_hack(vm_files, mode, settings, repeat)
+        difference = first_difference(cells, vm.ram, cpu.ram)
+        if difference:
+            problems.append((mode, difference))
+    return problems
+
+
+def main():
+    args = sys.argv[1:]
+    cases, seed, workers, overflow, flags = 1000, 0, None, False, []
+    while args:
+        arg = args.pop(0)
+        if arg == "-n" and args:
+            cases = int(args.pop(0))
+        elif arg == "--seed" and args:
+            seed = int(args.pop(0))
+        elif arg == "-j" and args:
+            workers = int(args.pop(0))
+        elif arg == "--overflow":
+            overflow = True
+        elif arg == "--dump" and args:
+            for name, commands in ProgramGenerator(int(args.pop(0)), overflow).generate().items():
+                print(f"// {name}\n{to_text(commands)}")
+            return
+        elif arg in OPTION_FLAGS:
+            flags.append(arg)
+        else:
+            print(__doc__.strip().split("\n\n")[-2])
+            return
+    modes = [" ".join(flags)] if flags else MODES
+
+    tests = sorted(t for t in glob.glob(os.path.join(TESTS, "[78]", "*", "*", "*.tst"))
+                   if not t.endswith("VME.tst"))
+    seeds = range(seed, seed + cases)
+    failures = {mode: [] for mode in modes}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for tst_path, problems in zip(tests, pool.map(check_test, tests, [modes] * len(tests))):
+            for mode, problem in problems:
+                failures.setdefault(mode, []).append(f"{os.path.basename(tst_path)}: {problem}")
+        results = pool.map(check_generated, seeds, [modes] * cases, [overflow] * cases,
+                           chunksize=max(1, cases // 64))
+        for case, problems in zip(seeds, results):
+            for mode, problem in problems:
+                failures.setdefault(mode, []).append(f"seed {case}: {problem}")
+
+    print(f"{len(tests)} project tests, {cases} generated programs")
+    for mode, found in failures.items():
+        print(f"  [{mode or 'default'}] {'ok' if not found else f'{len(found)} FAILED'}")
+        for problem in found[:5]:
+            print(f"      {problem}")
+    if any(failures.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
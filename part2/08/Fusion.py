@@ -0,0 +1,392 @@
+"""
+Fusion.py
+
+Superinstructions: a stage between the Parser and CodeWriter that
+recognizes frequent VM command sequences and replaces each with one
+fused command, translated by hand-tuned assembly (see FUSED below).
+
+Like the peephole optimizer, fused code only assumes that RAM at and
+above SP is scratch: segment contents, pointers, temp and SP itself
+end up exactly as the separate commands would leave them.
+
+Run as a script to count the most frequent n-grams of a corpus:
+    python3 Fusion.py [-n N] [--top K] <file.vm|directory>...
+"""
+import sys
+import os
+from collections import Counter
+from CommandType import *
+
+C_FUSED = "fused"  # command type of a fused sequence: (C_FUSED, name, commands)
+
+# segments addressed through a base pointer
+BASES = {"local": "LCL", "argument": "ARG", "this": "THIS", "that": "THAT"}
+COMPARE_JUMP = {"eq": "JEQ", "gt": "JGT", "lt": "JLT"}
+COMPARE_NOT_JUMP = {"eq": "JNE", "gt": "JLE", "lt": "JGE"}
+
+
+def _is(command, ctype, arg1=None, arg2=None):
+    return (
+        command[0] == ctype
+        and (arg1 is None or command[1] == arg1)
+        and (arg2 is None or command[2] == arg2)
+    )
+
+
+def _is_compare(command):
+    return command[0] == C_ARITHMETIC and command[1] in COMPARE_JUMP
+
+
+def _match_array_write(window):
+    # pop temp t / pop pointer 1 / push temp t / pop that 0  (a[i] = x)
+    pop_temp, pop_that, push_temp, pop_elem = window
+    return (
+        _is(pop_temp, C_POP, "temp")
+        and _is(pop_that, C_POP, "pointer", 1)
+        and _is(push_temp, C_PUSH, "temp", pop_temp[2])
+        and _is(pop_elem, C_POP, "that", 0)
+    )
+
+
+def _match_in_place(window):
+    # push S i / push constant k / add|sub / pop S i  (x = x + k)
+    push, constant, op, pop = window
+    return (
+        push[0] == C_PUSH
+        and push[1] != "constant"
+        and _is(constant, C_PUSH, "constant")
+        and op[0] == C_ARITHMETIC and op[1] in ("add", "sub")
+        and _is(pop, C_POP, push[1], push[2])
+    )
+
+
+def _match_array_read(window):
+    # add / pop pointer 1 / push that 0  (x = a[i])
+    return (
+        _is(window[0], C_ARITHMETIC, "add")
+        and _is(window[1], C_POP, "pointer", 1)
+        and _is(window[2], C_PUSH, "that", 0)
+    )
+
+
+def _match_compare_not_if(window):
+    return _is_compare(window[0]) and _is(window[1], C_ARITHMETIC, "not") and window[2][0] == C_IF
+
+
+def _match_compare_if(window):
+    return _is_compare(window[0]) and window[1][0] == C_IF
+
+
+def _match_not_if(window):
+    return _is(window[0], C_ARITHMETIC, "not") and window[1][0] == C_IF
+
+
+def _match_push_if(window):
+    return window[0][0] == C_PUSH and window[1][0] == C_IF
+
+
+def _match_push_return(window):
+    return window[0][0] == C_PUSH and window[1][0] == C_RETURN
+
+
+def _match_move(window):
+    return window[0][0] == C_PUSH and window[1][0] == C_POP
+
+
+# (name, length, matcher), tried longest first
+PATTERNS = [
+    ("array_write", 4, _match_array_write),
+    ("in_place", 4, _match_in_place),
+    ("array_read", 3, _match_array_read),
+    ("compare_not_if", 3, _match_compare_not_if),
+    ("compare_if", 2, _match_compare_if),
+    ("not_if", 2, _match_not_if),
+    ("push_if", 2, _match_push_if),
+    ("push_return", 2, _match_push_return),
+    ("move", 2, _match_move),
+]
+
+
+def patterns_for(shared_calls=False, shared_compare=False, cache_top=False):
+    """
+    The patterns that keep the semantics of the given CodeWriter mode.
+    Shared comparisons are overflow-safe, the fused ones subtract like
+    the inline templates; a shared return pops its value itself.
+    With the stack top cached in D, the unfused code of most patterns
+    is as short already, and a fused command would first spill D.
+    """
+    skip = set()
+    if cache_top:
+        skip |= {name for name, _, _ in PATTERNS} - {"in_place", "push_return"}
+    if shared_compare:
+        skip |= {"compare_if", "compare_not_if"}
+    if shared_calls:
+        skip.add("push_return")
+    return [pattern for pattern in PATTERNS if pattern[0] not in skip]
+
+
+def fuse(commands, patterns=PATTERNS):
+    """
+    Yields the (command type, arg1, arg2) commands, with every matched
+    sequence replaced by (C_FUSED, name, commands). Reads ahead only as
+    far as the longest pattern, so streaming input stays streaming.
+    """
+    commands = iter(commands)
+    longest = max(size for _, size, _ in patterns)
+    window = []
+    while True:
+        for command in commands:
+            window.append(command)
+            if len(window) == longest:
+                break
+        if not window:
+            return
+        for name, size, match in patterns:
+            if len(window) >= size and match(window[:size]):
+                yield C_FUSED, name, tuple(window[:size])
+                del window[:size]
+                break
+        else:
+            yield window.pop(0)
+
+
+# ====== Assembly of the fused commands ======
+
+def _scoped(cw, label):
+    """
+    Label as writeIf scopes it.
+    """
+    return f"{cw.current_function}${label}" if cw.current_function else label
+
+
+def _direct(cw, segment, idx):
+    """
+    Symbol of a segment entry that needs no pointer arithmetic, or None.
+    """
+    if segment == "temp":
+        return str(5 + idx)
+    if segment == "static":
+        return f"{cw.filename}.{idx}"
+    if segment == "pointer":
+        return "THIS" if idx == 0 else "THAT"
+    return None
+
+
+def _address(cw, segment, idx):
+    """
+    Sets A to the address of segment[idx] without touching D, or None
+    if that needs D.
+    """
+    symbol = _direct(cw, segment, idx)
+    if symbol is not None:
+        return f"@{symbol}\n"
+    if idx == 0:
+        return f"@{BASES[segment]}\nA=M\n"
+    if idx == 1:
+        return f"@{BASES[segment]}\nA=M+1\n"
+    return None
+
+
+def _address_to_r13(segment, idx):
+    """
+    Stores the address of base segment[idx] in R13.
+    """
+    return f"@{idx}\nD=A\n@{BASES[segment]}\nD=D+M\n@R13\nM=D\n"
+
+
+def load_d(cw, segment, idx):
+    """
+    Sets D to the value `push segment idx` would push.
+    """
+    if segment == "constant":
+        return f"D={idx}\n" if idx in (0, 1) else f"@{idx}\nD=A\n"
+    address = _address(cw, segment, idx)
+    if address is None:
+        address = f"@{idx}\nD=A\n@{BASES[segment]}\nA=D+M\n"
+    return address + "D=M\n"
+
+
+def _store(cw, segment, idx, value):
+    """
+    Writes to segment[idx] either the constant "0" or "1" or, given
+    the assembly that loads it, the value in D.
+    """
+    address = _address(cw, segment, idx)
+    if value in ("0", "1"):
+        if address is None:
+            return f"@{idx}\nD=A\n@{BASES[segment]}\nA=D+M\nM={value}\n"
+        return address + f"M={value}\n"
+    if address is None:
+        return _address_to_r13(segment, idx) + value + "@R13\nA=M\nM=D\n"
+    return value + address + "M=D\n"
+
+
+def _comment(commands):
+    """
+    One comment line per fused command, like CodeWriter's own.
+    """
+    lines = []
+    for ctype, arg1, arg2 in commands:
+        if ctype == C_ARITHMETIC:
+            text = arg1
+        elif ctype == C_RETURN:
+            text = ctype
+        elif arg2 is None:
+            text = f"{ctype} {arg1}"
+        else:
+            text = f"{ctype} {arg1} {arg2}"
+        lines.append(f"//{text}\n")
+    return "".join(lines)
+
+
+def _write_array_write(cw, commands):
+    temp = 5 + commands[0][2]
+    return (
+        "@SP\nAM=M-1\nD=M\n"
+        f"@{temp}\nM=D\n"
+        "@SP\nAM=M-1\nD=M\n"
+        "@THAT\nM=D\n"
+        f"@{temp}\nD=M\n"
+        "@THAT\nA=M\nM=D\n"
+    )
+
+
+def _write_in_place(cw, commands):
+    (_, segment, idx), (_, _, k), (_, op, _), _ = commands
+    if k == 0:
+        return ""
+    sign = "+" if op == "add" else "-"
+    address = _address(cw, segment, idx)
+    if k == 1:
+        if address is None:
+            address = f"@{idx}\nD=A\n@{BASES[segment]}\nA=D+M\n"
+        return address + f"M=M{sign}1\n"
+    update = "M=D+M\n" if op == "add" else "M=M-D\n"
+    if address is None:
+        return _address_to_r13(segment, idx) + f"@{k}\nD=A\n@R13\nA=M\n" + update
+    return f"@{k}\nD=A\n" + address + update
+
+
+def _write_array_read(cw, commands):
+    return (
+        "@SP\nAM=M-1\nD=M\nA=A-1\nD=D+M\n"
+        "@THAT\nM=D\n"
+        "A=D\nD=M\n"
+        "@SP\nA=M-1\nM=D\n"
+    )
+
+
+def _write_compare_if(cw, commands):
+    jumps = COMPARE_NOT_JUMP if len(commands) == 3 else COMPARE_JUMP
+    return (
+        "@SP\nAM=M-1\nD=M\n"
+        "@SP\nAM=M-1\nD=M-D\n"
+        f"@{_scoped(cw, commands[-1][1])}\nD;{jumps[commands[0][1]]}\n"
+    )
+
+
+def _write_not_if(cw, commands):
+    # not is bitwise: jump unless the value is -1 (not merely unless it is 0)
+    return f"@SP\nAM=M-1\nD=!M\n@{_scoped(cw, commands[1][1])}\nD;JNE\n"
+
+
+def _write_push_if(cw, commands):
+    (_, segment, idx), (_, label, _) = commands
+    target = _scoped(cw, label)
+    if segment == "constant":
+        return f"@{target}\n0;JMP\n" if idx else ""
+    return load_d(cw, segment, idx) + f"@{target}\nD;JNE\n"
+
+
+def _write_push_return(cw, commands):
+    _, segment, idx = commands[0]
+    return cw._returnSequence(load_d(cw, segment, idx))
+
+
+def _write_move(cw, commands):
+    (_, source, source_idx), (_, segment, idx) = commands
+    if source == "constant" and source_idx in (0, 1):
+        return _store(cw, segment, idx, str(source_idx))
+    return _store(cw, segment, idx, load_d(cw, source, source_idx))
+
+
+FUSED = {
+    "array_write": _write_array_write,
+    "in_place": _write_in_place,
+    "array_read": _write_array_read,
+    "compare_not_if": _write_compare_if,
+    "compare_if": _write_compare_if,
+    "not_if": _write_not_if,
+    "push_if": _write_push_if,
+    "push_return": _write_push_return,
+    "move": _write_move,
+}
+
+
+def fused_assembly(cw, name, commands):
+    """
+    Assembly of one fused command for CodeWriter cw.
+    """
+    return _comment(commands) + FUSED[name](cw, commands)
+
+
+# ====== n-gram statistics ======
+
+def shape(command):
+    """
+    What a pattern can match on: the command without label and function
+    names. Constant and segment indices are kept, they change the code.
+    """
+    ctype, arg1, arg2 = command
+    if ctype == C_ARITHMETIC:
+        return arg1
+    if ctype in (C_PUSH, C_POP):
+        return f"{ctype} {arg1} {arg2}"
+    return ctype
+
+
+def ngram_counts(vm_files, n):
+    """
+    Counts the n-grams of command shapes over vm_files.
+    """
+    from Parser import Parser
+    counts = Counter()
+    for vm_file in vm_files:
+        shapes = [shape(command) for command in Parser(vm_file).commands()]
+        for i in range(len(shapes) - n + 1):
+            counts[tuple(shapes[i:i + n])] += 1
+    return counts
+
+
+def main():
+    args = sys.argv[1:]
+    n, top, paths = 2, 20, []
+    while args:
+        arg = args.pop(0)
+        if arg == "-n" and args:
+            n = int(args.pop(0))
+        elif arg == "--top" and args:
+            top = int(args.pop(0))
+        else:
+            paths.append(arg)
+    if not paths or n < 1:
+        print("Usage: python3 Fusion.py [-n N] [--top K] <file.vm|directory>...")
+        print("Lists the most frequent sequences of N VM commands (default 2).")
+        return
+
+    vm_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            vm_files += sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".vm"))
+        else:
+            vm_files.append(path)
+
+    counts = ngram_counts(vm_files, n)
+    total = sum(counts.values())
+    print(f"{len(vm_files)} files, {total} {n}-grams, {len(counts)} distinct")
+    for ngram, count in counts.most_common(top):
+        print(f"{count:7} {100 * count / total:5.1f}%  " + " / ".join(ngram))
+
+
+if __name__ == "__main__":
+    main()
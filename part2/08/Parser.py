@@ -1,33 +1,125 @@
+from array import array
 from CommandType import *
 
+# First word of a command -> command type (anything else is arithmetic)
+KEYWORDS = {
+    "push": C_PUSH,
+    "pop": C_POP,
+    "label": C_LABEL,
+    "goto": C_GOTO,
+    "if-goto": C_IF,
+    "function": C_FUNCTION,
+    "call": C_CALL,
+    "return": C_RETURN,
+}
+OPCODES = {ctype: opcode for opcode, ctype in enumerate(COMMAND_TYPES)}
+HAS_ARG2 = (C_PUSH, C_POP, C_FUNCTION, C_CALL)
+NO_ARG = -0x80000000  # arg1/arg2 slot of a command without that argument
+
+
+def decode(line):
+    """
+    Splits one source line into (command type, arg1, arg2).
+    Missing arguments are None; blank and comment-only lines give None.
+    """
+    command_parts = line.split("//", 1)[0].split()
+    if not command_parts:
+        return None
+
+    ctype = KEYWORDS.get(command_parts[0], C_ARITHMETIC)
+    if ctype == C_ARITHMETIC:
+        arg1 = command_parts[0]
+    elif ctype != C_RETURN and len(command_parts) >= 2:
+        arg1 = command_parts[1]
+    else:
+        arg1 = None
+
+    arg2 = None
+    if ctype in HAS_ARG2 and len(command_parts) >= 3:
+        try:
+            arg2 = int(command_parts[2])
+        except ValueError:
+            pass
+    return ctype, arg1, arg2
+
+
+def stream_commands(file_path):
+    """
+    Streaming mode: yields (command type, arg1, arg2) while reading the
+    file line by line. Nothing is kept, so memory stays constant however
+    large the input is.
+    """
+    with open(file_path, "r") as file:
+        for line in file:
+            command = decode(line)
+            if command is not None:
+                yield command
+
+
 class Parser:
     """
     Handles parsing of a single .vm file.
-    Reads VM commands, removes comments/whitespace, and provides access to command parts.
+    Each line is split exactly once and decoded into three parallel arrays:
+    an integer opcode, the id of arg1 in a shared name table (arithmetic
+    command, segment, label or function name) and the integer arg2.
     """
-    
+
     def __init__(self, file_path):
+        self.names = []      # arg1 strings, each stored once
+        self.name_ids = {}
+        self.ops = array("b")
+        self.arg1s = array("i")
+        self.arg2s = array("i")
         with open(file_path, "r") as file:
-            self.lines = [self._clean_line(line) for line in file]
-        self.lines = [line for line in self.lines if line]
+            for line in file:
+                self._decode(line)
         self.idx = 0
-        self.current_command = ""
+        self.current = NO_ARG
 
+    def _name_id(self, name):
+        """
+        Returns the index of name in the name table, adding it if new.
+        """
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
 
-    def _clean_line(self, line):
+    def _decode(self, line):
         """
-        Removes comments and whitespace from a line.
+        Decodes one source line and appends its command to the arrays.
+        Blank and comment-only lines are skipped.
         """
-        line = line.strip()
-        if "//" in line:
-            line = line.split('//')[0].strip()
-        return line
+        command = decode(line)
+        if command is None:
+            return
+        ctype, arg1, arg2 = command
+        self.ops.append(OPCODES[ctype])
+        self.arg1s.append(self._name_id(arg1) if arg1 is not None else NO_ARG)
+        self.arg2s.append(arg2 if arg2 is not None else NO_ARG)
+
+    def __len__(self):
+        return len(self.ops)
+
+    def commands(self):
+        """
+        Yields (command type, arg1, arg2) for every command, in order.
+        Missing arguments are None, as with arg1() and arg2().
+        """
+        names = self.names
+        for op, arg1, arg2 in zip(self.ops, self.arg1s, self.arg2s):
+            yield (
+                COMMAND_TYPES[op],
+                names[arg1] if arg1 != NO_ARG else None,
+                arg2 if arg2 != NO_ARG else None,
+            )
 
     def hasMoreLines(self):
         """
         Returns True if there are more commands in the input.
         """
-        return self.idx < len(self.lines)
+        return self.idx < len(self.ops)
 
     def advance(self):
         """
@@ -35,7 +127,7 @@ class Parser:
         Should only be called if hasMoreLines() is True.
         """
         if self.hasMoreLines():
-            self.current_command = self.lines[self.idx]
+            self.current = self.idx
             self.idx += 1
 
     def commandType(self):
@@ -43,33 +135,9 @@ class Parser:
         Returns the type of the current VM command.
         Matches the string constants from CommandType.py
         """
-        if not self.current_command:
+        if self.current == NO_ARG:
             return None
-
-        command_parts = self.current_command.split()
-        if not command_parts:
-            return None
-
-        first_word = command_parts[0]
-
-        if first_word == "push":
-            return C_PUSH
-        elif first_word == "pop":
-            return C_POP
-        elif first_word == "label":
-            return C_LABEL
-        elif first_word == "goto":
-            return C_GOTO
-        elif first_word == "if-goto":
-            return C_IF
-        elif first_word == "function":
-            return C_FUNCTION
-        elif first_word == "call":
-            return C_CALL
-        elif first_word == "return":
-            return C_RETURN
-        else:
-            return C_ARITHMETIC  # add, sub, neg, eq, gt, lt, and, or, not
+        return COMMAND_TYPES[self.ops[self.current]]
 
     def arg1(self):
         """
@@ -77,33 +145,17 @@ class Parser:
         For arithmetic commands, returns the command itself.
         Should not be called if the current command is C_RETURN.
         """
-        if not self.current_command:
-            return None
-
-        command_parts = self.current_command.split()
-        ctype = self.commandType()
-        
-        if ctype == C_ARITHMETIC:
-            return command_parts[0]
-        elif ctype != C_RETURN and len(command_parts) >= 2:
-            return command_parts[1]
-        else:
+        if self.current == NO_ARG:
             return None
+        arg1 = self.arg1s[self.current]
+        return self.names[arg1] if arg1 != NO_ARG else None
 
     def arg2(self):
         """
         Returns the second argument of the current command (if any).
         Should be called only if the current command is C_PUSH, C_POP, C_FUNCTION, or C_CALL.
         """
-        if not self.current_command:
+        if self.current == NO_ARG:
             return None
-
-        command_parts = self.current_command.split()
-        ctype = self.commandType()
-
-        if ctype in (C_PUSH, C_POP, C_FUNCTION, C_CALL) and len(command_parts) >= 3:
-            try:
-                return int(command_parts[2])
-            except ValueError:
-                return None
-        return None
\ No newline at end of file
+        arg2 = self.arg2s[self.current]
+        return arg2 if arg2 != NO_ARG else None
@@ -0,0 +1,137 @@
+"""
+Peephole.py
+
+Optional optimization stage between CodeWriter and the output file.
+Rewrites the Hack assembly stream with small local patterns:
+redundant SP increment/decrement pairs, a push immediately popped again,
+split SP-decrement/load pairs and dead @X loads.
+
+The only assumption beyond exact machine equivalence is that RAM at and
+above SP is scratch, so the slot store of a push that is immediately
+popped again may be dropped. Comment lines are not kept.
+"""
+
+# push value in D ... pop it back into D
+PUSH = ["@SP", "A=M", "M=D", "@SP", "M=M+1"]
+POP_TO_D = ["@SP", "M=M-1", "A=M", "D=M"]
+POP_TO_D_IF = ["@SP", "AM=M-1", "D=M"]
+
+
+def _is_a(line):
+    return line is not None and line.startswith("@")
+
+
+def _matches(lines, i, pattern):
+    return lines[i:i + len(pattern)] == pattern
+
+
+def _rewrite(lines):
+    """
+    One left-to-right pass. Returns the rewritten list.
+    """
+    out = []
+    i = 0
+    n = len(lines)
+    while i < n:
+        line = lines[i]
+
+        # push + pop into D: D already holds the value, both SP moves cancel.
+        # A is left different, so the next instruction must reload it.
+        if line == "@SP":
+            folded = False
+            for pop in (POP_TO_D, POP_TO_D_IF):
+                size = len(PUSH) + len(pop)
+                if _matches(lines, i, PUSH + pop) and _is_a(lines[i + size] if i + size < n else None):
+                    i += size
+                    folded = True
+                    break
+            if folded:
+                continue
+
+            # SP++ immediately undone
+            if lines[i + 1:i + 4] == ["M=M+1", "@SP", "M=M-1"]:
+                out.append("@SP")
+                i += 4
+                continue
+            if lines[i + 1:i + 4] == ["M=M+1", "@SP", "AM=M-1"]:
+                out += ["@SP", "A=M"]
+                i += 4
+                continue
+
+        # M=M-1 / A=M -> AM=M-1 (and likewise for +1)
+        if line in ("M=M-1", "M=M+1") and i + 1 < n and lines[i + 1] == "A=M":
+            out.append("A" + line)
+            i += 2
+            continue
+
+        # M=D / D=M: D is unchanged
+        if line == "M=D" and i + 1 < n and lines[i + 1] == "D=M":
+            out.append(line)
+            i += 2
+            continue
+
+        # @X immediately overwritten by @Y
+        if line.startswith("@") and i + 1 < n and lines[i + 1].startswith("@"):
+            i += 1
+            continue
+
+        out.append(line)
+        i += 1
+    return out
+
+
+def count_instructions(lines):
+    """
+    Number of ROM words: every line except labels.
+    """
+    return sum(1 for line in lines if not line.startswith("("))
+
+
+def optimize(text):
+    """
+    Optimizes Hack assembly text. Returns (lines, instructions before, after).
+    """
+    lines = []
+    for line in text.splitlines():
+        line = line.split("//")[0].strip()
+        if line:
+            lines.append(line)
+    before = count_instructions(lines)
+
+    while True:
+        rewritten = _rewrite(lines)
+        if rewritten == lines:
+            break
+        lines = rewritten
+    return lines, before, count_instructions(lines)
+
+
+class Peephole:
+    """
+    File-like wrapper: collects what CodeWriter writes and, on flush,
+    writes the optimized assembly to the underlying sink.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.chunks = []
+        self.before = 0
+        self.after = 0
+
+    def write(self, text):
+        self.chunks.append(text)
+
+    def flush(self):
+        """
+        Optimizes everything written so far and passes it on. CodeWriter
+        calls this once, on close, so patterns are never cut in two.
+        """
+        lines, self.before, self.after = optimize("".join(self.chunks))
+        self.chunks = []
+        self.file.write("\n".join(lines) + "\n")
+        self.file.flush()
+
+    def report(self):
+        saved = self.before - self.after
+        percent = 100 * saved / self.before if self.before else 0
+        return f"Peephole: {self.before} -> {self.after} instructions (saved {saved}, {percent:.1f}%)"
@@ -0,0 +1,106 @@
+"""
+Pipeline.py
+
+VM -> ROM in one process. CodeWriter writes straight into an
+AssemblerSink, which turns each chunk into structured instructions
+(finished words, symbol references, label declarations) and feeds them
+to the assembler, so no .asm or .hack text is written and parsed again.
+CodeWriter repeats the same templates over and over, so each distinct
+chunk is decoded only once.
+"""
+import sys
+import os
+from VMTranslator import FLAGS, OPTION_FLAGS, find_vm_files, options_from_flags, translate
+
+# The assembler lives in part1/06
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "part1", "06"))
+from assembler import Assembler, decode, toText
+import hackimage
+
+ROM_SIZE = 32768
+
+PIPELINE_FLAGS = {
+    "--asm": "also write the intermediate .asm file",
+    "--hack": "also write the .hack text file",
+    "--symbols": "store the symbol table in the .hackbin image",
+}
+
+
+class AssemblerSink:
+    """
+    CodeWriter sink that assembles what it receives.
+    Optionally tees the text to an .asm file for debugging.
+    """
+
+    def __init__(self, assembler, asm_file=None):
+        self.assembler = assembler
+        self.asm_file = asm_file
+        self.decoded = {}  # chunk text -> structured instructions
+        assembler.reset()
+
+    def write(self, text):
+        items = self.decoded.get(text)
+        if items is None:
+            items = self.decoded[text] = decode(text.splitlines())
+        self.assembler.feed(items)
+        if self.asm_file:
+            self.asm_file.write(text)
+
+    def flush(self):
+        if self.asm_file:
+            self.asm_file.flush()
+
+
+def build(vm_files, asm_path=None, **options):
+    """
+    Translates and assembles vm_files in memory.
+    Returns (ROM words, the Assembler holding the symbol table).
+    options are passed on to translate().
+    """
+    assembler = Assembler()
+    asm_file = open(asm_path, "w") if asm_path else None
+    try:
+        translate(vm_files, AssemblerSink(assembler, asm_file), **options)
+    finally:
+        if asm_file:
+            asm_file.close()
+    return assembler.finish(), assembler
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("-")]
+    flags = [arg for arg in sys.argv[1:] if arg.startswith("-")]
+    known = {flag: FLAGS[flag] for flag in OPTION_FLAGS}
+    known.update(PIPELINE_FLAGS)
+    if len(args) != 1 or any(flag not in known for flag in flags):
+        print("Usage: python3 Pipeline.py [options] <file.vm|directory>")
+        print("Writes the .hackbin ROM image.")
+        for flag, text in known.items():
+            print(f"  {flag:<14} {text}")
+        return
+
+    found = find_vm_files(args[0])
+    if found is None:
+        return
+    vm_files, output_file = found
+    stem = os.path.splitext(output_file)[0]
+
+    words, assembler = build(
+        vm_files,
+        asm_path=output_file if "--asm" in flags else None,
+        **options_from_flags(flags),
+    )
+
+    image_path = stem + hackimage.EXTENSION
+    hackimage.write_image(image_path, words, assembler.symbols() if "--symbols" in flags else None)
+    print(f"Output: {image_path} ({len(words)} words)")
+    if "--hack" in flags:
+        with open(stem + ".hack", "w") as file:
+            file.write(toText(words))
+        print(f"Output: {stem}.hack")
+    if len(words) > ROM_SIZE:
+        print(f"Warning: program does not fit in the {ROM_SIZE}-word ROM")
+
+
+if __name__ == "__main__":
+    main()
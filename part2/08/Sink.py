@@ -0,0 +1,83 @@
+"""
+Sink.py
+
+Output targets for CodeWriter. Anything CodeWriter writes to only needs
+write(text) and flush(); open_sink() adapts the supported targets:
+a file path, an open file object (e.g. io.StringIO), a list of chunks,
+or a callback taking each chunk.
+"""
+
+
+class ListSink:
+    """
+    Appends every chunk to a list.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def write(self, text):
+        self.chunks.append(text)
+
+    def flush(self):
+        pass
+
+
+class CallbackSink:
+    """
+    Hands every chunk to a function, e.g. one feeding the assembler.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, text):
+        self.callback(text)
+
+    def flush(self):
+        pass
+
+
+class BatchedSink:
+    """
+    Collects chunks and passes them on joined, in blocks of at least
+    batch_size characters.
+    """
+
+    def __init__(self, sink, batch_size):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.chunks = []
+        self.size = 0
+
+    def write(self, text):
+        self.chunks.append(text)
+        self.size += len(text)
+        if self.size >= self.batch_size:
+            self._drain()
+
+    def _drain(self):
+        if self.chunks:
+            self.sink.write("".join(self.chunks))
+            self.chunks = []
+            self.size = 0
+
+    def flush(self):
+        self._drain()
+        self.sink.flush()
+
+
+def open_sink(target):
+    """
+    Returns a writable sink for target and whether the caller opened it
+    (and so must close it).
+    """
+    if isinstance(target, str):
+        return open(target, "w"), True
+    if isinstance(target, list):
+        return ListSink(target), False
+    if hasattr(target, "write"):
+        return target, False
+    if callable(target):
+        return CallbackSink(target), False
+    raise TypeError(f"cannot write assembly to {type(target).__name__}")
@@ -0,0 +1,439 @@
+"""
+TestRunner.py
+
+Runs the course's .tst scripts in-process and compares their output with
+the .cmp files, like the CPU and VM emulators of the nand2tetris tools:
+
+- `load X.asm` (CPU emulator): X.vm, or else every .vm file of the
+  folder, goes through translate -> assemble (Pipeline.build) with the
+  given translator flags; with no .vm files, X.asm or X.hack is loaded.
+  It runs on the Hack emulator of part1/06.
+- `load X.vm` or a bare `load` (VM emulator): runs on VMEmulator.py,
+  started at Sys.init when there is one, without bootstrap code.
+- `load Computer.hdl` (project 5): the ROM32K program runs cycle by
+  cycle on the Hack emulator, halt loops included.
+
+Other chips need an HDL simulator; their scripts are skipped. Scripts
+run in parallel across cores.
+
+    python3 TestRunner.py [-j WORKERS] [flags...] [file.tst|directory]...
+
+Without paths, the project 5, 7 and 8 tests are run.
+"""
+import sys
+import os
+import io
+import re
+import time
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from VMEmulator import VMEmulator
+from VMOptimizer import to_word
+from VMTranslator import FLAGS, OPTION_FLAGS, options_from_flags
+from Pipeline import build
+from emulator import Emulator, read_program  # part1/06, put on the path by Pipeline
+
+PROJECTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "nand2tetris", "projects")
+DEFAULT_TESTS = [os.path.join(PROJECTS, project) for project in ("5", "7", "8")]
+
+# words of a script: strings, braces, separators, anything else
+TOKEN = re.compile(r'"[^"]*"|[{},;]|[^\s{},;]+')
+COMMENT = re.compile(r"//[^\n]*|/\*.*?\*/", re.S)
+COLUMN = re.compile(r"(.+)%([BDSX])(\d+)\.(\d+)\.(\d+)$")
+STEPS = ("ticktock", "vmstep")
+
+
+class Skip(Exception):
+    """
+    The script needs something this runner does not simulate.
+    """
+
+
+def parse_value(text):
+    """
+    A set value: decimal, or %B binary, %D decimal, %X hex.
+    """
+    if text[:2].upper() in ("%B", "%D", "%X"):
+        return to_word(int(text[2:], {"B": 2, "D": 10, "X": 16}[text[1].upper()]))
+    return to_word(int(text))
+
+
+def parse_script(text):
+    """
+    The commands of a script: a list of word lists. A block ends its
+    command's words with the list of commands inside it, as in
+    ["repeat", "14", body].
+    """
+    tokens = TOKEN.findall(COMMENT.sub("", text))
+    position = 0
+
+    def block():
+        nonlocal position
+        commands, words = [], []
+        while position < len(tokens):
+            token = tokens[position]
+            position += 1
+            if token in (",", ";"):
+                if words:
+                    commands.append(words)
+                words = []
+            elif token == "{":
+                commands.append(words + [block()])
+                words = []
+            elif token == "}":
+                break
+            else:
+                words.append(token)
+        if words:
+            commands.append(words)
+        return commands
+
+    return block()
+
+
+def parse_column(spec):
+    """
+    (name, format, left pad, width, right pad) of an output-list entry.
+    """
+    match = COLUMN.match(spec)
+    if not match:
+        raise ValueError(f"bad output-list entry {spec}")
+    name, fmt, left, width, right = match.groups()
+    return name, fmt, int(left), int(width), int(right)
+
+
+def header(columns):
+    line = "|"
+    for name, _, left, width, right in columns:
+        space = left + width + right
+        name = name[:space]
+        before = (space - len(name)) // 2
+        line += " " * before + name + " " * (space - before - len(name)) + "|"
+    return line
+
+
+def format_value(value, fmt, width):
+    if fmt == "S":
+        return str(value)[:width].ljust(width)
+    if fmt == "B":
+        return format(value & 0xFFFF, "016b")[-width:].rjust(width, "0")
+    if fmt == "X":
+        return format(value & 0xFFFF, "04X")[-width:].rjust(width, "0")
+    return str(value).rjust(width)
+
+
+def row(columns, target):
+    line = "|"
+    for name, fmt, left, width, right in columns:
+        line += " " * left + format_value(target.get(name), fmt, width) + " " * right + "|"
+    return line
+
+
+def matches(expected, actual):
+    """
+    True if an output line equals a .cmp line, where * matches anything.
+    """
+    expected, actual = expected.rstrip(), actual.rstrip()
+    return len(expected) == len(actual) and all(
+        e == a or e == "*" for e, a in zip(expected, actual))
+
+
+# ====== Simulated machines ======
+
+class Target:
+    """
+    What a script runs on. The clock counts tocks; tick only marks the
+    half cycle, the whole instruction runs at tock.
+    """
+
+    def __init__(self):
+        self.time = 0
+        self.half = False
+
+    def tick(self):
+        self.half = True
+
+    def tock(self):
+        self.step(1)
+        self.time += 1
+        self.half = False
+
+    def steps(self, n):
+        self.step(n)
+        self.time += n
+
+    def get(self, name):
+        if name == "time":
+            return f"{self.time}+" if self.half else self.time
+        raise ValueError(f"unknown variable {name}")
+
+    def set(self, name, value):
+        raise ValueError(f"unknown variable {name}")
+
+
+def _index(name, prefix):
+    """
+    i of prefix[i] in name, or None.
+    """
+    if name.startswith(prefix + "[") and name.endswith("]"):
+        return int(name[len(prefix) + 1:-1])
+    return None
+
+
+class CPUTarget(Target):
+    """
+    CPU emulator: RAM[i], A, D and PC.
+    """
+
+    def __init__(self, words):
+        super().__init__()
+        self.cpu = Emulator(words)
+
+    def step(self, n):
+        self.cpu.run(n)
+
+    def get(self, name):
+        address = _index(name, "RAM")
+        if address is not None:
+            return self.cpu.ram[address]
+        if name in ("A", "D"):
+            return getattr(self.cpu, name)
+        if name == "PC":
+            return self.cpu.pc
+        return super().get(name)
+
+    def set(self, name, value):
+        address = _index(name, "RAM")
+        if address is None:
+            super().set(name, value)
+        self.cpu.ram[address] = value
+
+
+class ComputerTarget(CPUTarget):
+    """
+    The Computer chip of project 5: RAM16K[i], ARegister[], DRegister[],
+    PC[] and reset, with the program in ROM32K run cycle-exactly.
+    With reset set, the instruction still runs and then PC becomes 0.
+    """
+
+    def __init__(self):
+        super().__init__(())
+        self.reset = 0
+
+    def load_rom(self, path):
+        self.cpu.load(read_program(path), halts=False)
+
+    def step(self, n):
+        if not self.reset:
+            self.cpu.run(n)
+            return
+        for _ in range(n):
+            self.cpu.run(1)
+            self.cpu.pc = 0
+
+    def get(self, name):
+        register = name.split("[")[0]
+        if register == "reset":
+            return self.reset
+        if register in ("ARegister", "DRegister"):
+            return getattr(self.cpu, register[0])
+        if register == "PC":
+            return self.cpu.pc
+        if register == "RAM16K":
+            return self.cpu.ram[_index(name, "RAM16K")]
+        return super().get(name)
+
+    def set(self, name, value):
+        if name == "reset":
+            self.reset = value
+        elif name.startswith("RAM16K["):
+            self.cpu.ram[_index(name, "RAM16K")] = value
+        else:
+            super().set(name, value)
+
+
+class VMTarget(Target):
+    """
+    VM emulator: RAM[i], sp, local, argument, this, that and segment
+    entries like argument[i]. As in the tools' VM emulator, a program
+    with Sys.init starts there, with SP and the frame left to the script.
+    """
+    POINTERS = {"sp": 0, "local": 1, "argument": 2, "this": 3, "that": 4}
+
+    def __init__(self, vm_files):
+        super().__init__()
+        self.vm = VMEmulator(natives=False)
+        self.vm.load_files(vm_files)
+        if self.vm.bootstrap:
+            self.vm.pc = self.vm.functions["Sys.init"]
+
+    def step(self, n):
+        self.vm.run(n)
+
+    def address(self, name):
+        if name in self.POINTERS:
+            return self.POINTERS[name]
+        segment, _, index = name.partition("[")
+        if index.endswith("]"):
+            index = int(index[:-1])
+            if segment == "RAM":
+                return index
+            if segment == "temp":
+                return 5 + index
+            if segment in self.POINTERS and segment != "sp":
+                return self.vm.ram[self.POINTERS[segment]] + index
+        return None
+
+    def get(self, name):
+        address = self.address(name)
+        return super().get(name) if address is None else self.vm.ram[address]
+
+    def set(self, name, value):
+        address = self.address(name)
+        if address is None:
+            super().set(name, value)
+        self.vm.ram[address] = value
+
+
+def load_target(directory, name, flags):
+    """
+    The Target for `load name` in a script in directory.
+    """
+    vm_files = sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".vm"))
+    if name is None or name.endswith(".vm"):
+        if name is not None:
+            vm_files = [os.path.join(directory, name)]
+        if not vm_files:
+            raise ValueError("no .vm files to load")
+        return VMTarget(vm_files)
+    base, extension = os.path.splitext(name)
+    if extension == ".hdl":
+        if base != "Computer":
+            raise Skip(f"{name} needs an HDL simulator")
+        return ComputerTarget()
+    if extension not in (".asm", ".hack"):
+        raise ValueError(f"cannot load {name}")
+    if vm_files:
+        own = os.path.join(directory, base + ".vm")
+        with contextlib.redirect_stdout(io.StringIO()):
+            words, _ = build([own] if own in vm_files else vm_files, **options_from_flags(flags))
+        return CPUTarget(words)
+    return CPUTarget(read_program(os.path.join(directory, name)))
+
+
+# ====== Running a script ======
+
+def run_commands(commands, state):
+    for words in commands:
+        command = words[0]
+        target = state["target"]
+        if command == "repeat" and len(words) == 3:
+            count, body = int(words[1]), words[2]
+            if len(body) == 1 and body[0] in (["ticktock"], ["vmstep"]):
+                target.steps(count)
+            else:
+                for _ in range(count):
+                    run_commands(body, state)
+        elif command == "load":
+            state["target"] = load_target(state["directory"], words[1] if len(words) > 1 else None,
+                                          state["flags"])
+        elif command == "ROM32K" and words[1:2] == ["load"]:
+            target.load_rom(os.path.join(state["directory"], words[2]))
+        elif command == "compare-to":
+            state["compare"] = words[1]
+        elif command == "output-list":
+            state["columns"] = [parse_column(spec) for spec in words[1:]]
+            state["output"].append(header(state["columns"]))
+        elif command == "output":
+            state["output"].append(row(state["columns"], target))
+        elif command == "set":
+            target.set(words[1], parse_value(words[2]))
+        elif command == "tick":
+            target.tick()
+        elif command == "tock":
+            target.tock()
+        elif command in STEPS:
+            target.steps(1)
+        elif command in ("output-file", "echo", "eval"):
+            pass
+        else:
+            raise ValueError(f"unsupported command {' '.join(map(str, words))}")
+
+
+def run_test(tst_path, flags=()):
+    """
+    Worker: runs one script. Returns (status, message) with status
+    "ok", "FAIL", "skip" or "error".
+    """
+    directory = os.path.dirname(os.path.abspath(tst_path))
+    state = {"directory": directory, "flags": list(flags), "target": None,
+             "compare": None, "columns": [], "output": []}
+    try:
+        with open(tst_path) as file:
+            run_commands(parse_script(file.read()), state)
+    except Skip as reason:
+        return "skip", str(reason)
+    except (ValueError, IndexError, OSError) as error:
+        return "error", str(error)
+
+    if state["compare"] is None:
+        return "ok", f"{len(state['output'])} lines, no .cmp"
+    with open(os.path.join(directory, state["compare"])) as file:
+        expected = [line for line in file.read().splitlines() if line.strip()]
+    for number, (want, got) in enumerate(zip(expected, state["output"]), 1):
+        if not matches(want, got):
+            return "FAIL", f"line {number}\n    expected {want}\n    got      {got}"
+    if len(expected) != len(state["output"]):
+        return "FAIL", f"{len(state['output'])} lines written, {len(expected)} expected"
+    return "ok", f"{len(expected)} lines"
+
+
+def find_tests(paths):
+    tests = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                tests += [os.path.join(root, f) for f in files if f.endswith(".tst")]
+        else:
+            tests.append(path)
+    return sorted(tests)
+
+
+def main():
+    args = sys.argv[1:]
+    workers, flags, paths = os.cpu_count(), [], []
+    while args:
+        arg = args.pop(0)
+        if arg == "-j" and args:
+            workers = int(args.pop(0))
+        elif arg in OPTION_FLAGS:
+            flags.append(arg)
+        elif arg.startswith("-"):
+            print(__doc__.strip().split("\n\n")[-2])
+            for flag in OPTION_FLAGS:
+                print(f"  {flag:<14} {FLAGS[flag]}")
+            return
+        else:
+            paths.append(arg)
+
+    tests = find_tests(paths or DEFAULT_TESTS)
+    start = time.perf_counter()
+    if workers > 1 and len(tests) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_test, tests, [flags] * len(tests)))
+    else:
+        results = [run_test(test, flags) for test in tests]
+    seconds = time.perf_counter() - start
+
+    counts = {}
+    for test, (status, message) in zip(tests, results):
+        counts[status] = counts.get(status, 0) + 1
+        print(f"{status:<5} {os.path.relpath(test)}: {message}")
+    print(f"{len(tests)} scripts in {seconds:.2f}s: "
+          + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    if counts.get("FAIL") or counts.get("error"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+import sys
+import os
+import time
+from array import array
+from Parser import Parser
+from CommandType import *
+from VMOptimizer import to_word
+
+#python3 VMEmulator.py [--no-native] <file.vm|directory> [max_steps]
+# Runs a VM program directly, without translating it, and prints RAM[0..15].
+
+RAM_SIZE = 32768
+STACK = 256
+HEAP = 2048
+HEAP_END = 16384  # screen memory starts here
+STATIC = 16
+
+# opcodes, roughly by how often they run
+(PUSH_CONST, PUSH_LOCAL, PUSH_ARG, PUSH_THIS, PUSH_THAT, PUSH_RAM,
+ POP_LOCAL, POP_ARG, POP_THIS, POP_THAT, POP_RAM,
+ ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT,
+ GOTO, IF, FUNCTION, CALL, NATIVE, RETURN, BOOT, HALT) = range(28)
+
+PUSH_OPS = {"constant": PUSH_CONST, "local": PUSH_LOCAL, "argument": PUSH_ARG,
+            "this": PUSH_THIS, "that": PUSH_THAT}
+POP_OPS = {"local": POP_LOCAL, "argument": POP_ARG, "this": POP_THIS, "that": POP_THAT}
+ARITHMETIC_OPS = {"add": ADD, "sub": SUB, "neg": NEG, "eq": EQ, "gt": GT,
+                  "lt": LT, "and": AND, "or": OR, "not": NOT}
+
+
+# ====== Native OS functions ======
+# Each takes the emulator and the call's arguments and returns the
+# result, or None to run the VM implementation instead.
+
+def _multiply(vm, x, y):
+    return to_word(x * y)
+
+
+def _divide(vm, x, y):
+    if y == 0:
+        return None  # let the OS report the error
+    q = abs(x) // abs(y)
+    return to_word(q if (x < 0) == (y < 0) else -q)
+
+
+def _alloc(vm, size):
+    """
+    Exact-size free lists over a bump pointer. Like the OS, a block's
+    size is kept in the word before it, for deAlloc.
+    """
+    if size <= 0:
+        return None
+    free = vm.free_blocks.get(size)
+    if free:
+        return free.pop()
+    block = vm.heap_top + 1
+    if block + size > HEAP_END:
+        raise RuntimeError(f"Memory.alloc({size}): heap overflow")
+    vm.ram[block - 1] = size
+    vm.heap_top = block + size
+    return block
+
+
+def _dealloc(vm, block):
+    vm.free_blocks.setdefault(vm.ram[block - 1], []).append(block)
+    return 0
+
+
+# Memory.deAlloc goes with Memory.alloc: the OS one would not know the
+# native heap.
+NATIVES = {
+    "Math.multiply": _multiply,
+    "Math.divide": _divide,
+    "Memory.alloc": _alloc,
+    "Memory.deAlloc": _dealloc,
+}
+
+
+class VMEmulator:
+    """
+    Hack VM interpreter. Commands are compiled once into parallel lists
+    of opcodes and integer arguments: labels and functions resolve to
+    command indices, static variables to RAM addresses. The stack and
+    the segments live in one preallocated RAM array laid out as on the
+    Hack platform. With natives=False, RAM contents match the translated
+    program's; the native Memory.alloc keeps its own heap layout, so
+    with natives heap addresses and contents differ from the OS's.
+
+    SP, LCL and ARG are kept in locals while running and written back
+    to RAM[0..2] when run() returns.
+    """
+
+    def __init__(self, natives=True):
+        self.ram = array("i", bytes(4 * RAM_SIZE))
+        self.natives = natives
+        self.load([])
+
+    def load(self, programs):
+        """
+        Compiles programs, a list of (file name, commands) pairs, and
+        resets the VM. With Sys.init, the code starts with the bootstrap
+        VMTranslator writes: SP = 256, call Sys.init.
+        """
+        functions = {}  # function name -> index of its function command
+        labels = {}     # (function, label) -> index
+        statics = {}    # (file, index) -> RAM address
+        self.bootstrap = any(
+            ctype == C_FUNCTION and arg1 == "Sys.init"
+            for _, commands in programs for ctype, arg1, _ in commands
+        )
+
+        # Pass 1: positions. Labels take no slot.
+        position = 2 if self.bootstrap else 0
+        function = ""
+        for _, commands in programs:
+            for ctype, arg1, _ in commands:
+                if ctype == C_LABEL:
+                    labels[(function, arg1)] = position
+                    continue
+                if ctype == C_FUNCTION:
+                    function = arg1
+                    functions[arg1] = position
+                position += 1
+
+        ops, arg1s, arg2s, natives = [], [], [], []
+
+        def emit(op, arg1=0, arg2=0, native=None):
+            ops.append(op)
+            arg1s.append(arg1)
+            arg2s.append(arg2)
+            natives.append(native)
+
+        def emit_call(name, n_args):
+            if name == "Sys.halt":
+                emit(HALT)  # the OS version loops forever, in either mode
+            elif name in NATIVES and self.natives:
+                emit(NATIVE, functions.get(name, -1), n_args, NATIVES[name])
+            elif name in functions:
+                emit(CALL, functions[name], n_args)
+            else:
+                raise ValueError(f"call to undefined function {name}")
+
+        if self.bootstrap:
+            emit(BOOT)
+            emit_call("Sys.init", 0)
+
+        # Pass 2: code
+        function = ""
+        for file_name, commands in programs:
+            for ctype, arg1, arg2 in commands:
+                if ctype == C_PUSH or ctype == C_POP:
+                    if arg1 in ("static", "temp", "pointer"):
+                        if arg1 == "static":
+                            address = statics.setdefault((file_name, arg2), STATIC + len(statics))
+                        else:
+                            address = arg2 + (5 if arg1 == "temp" else 3)
+                        emit(PUSH_RAM if ctype == C_PUSH else POP_RAM, address)
+                    elif ctype == C_PUSH:
+                        emit(PUSH_OPS[arg1], arg2)
+                    else:
+                        emit(POP_OPS[arg1], arg2)
+                elif ctype == C_ARITHMETIC:
+                    emit(ARITHMETIC_OPS[arg1])
+                elif ctype == C_LABEL:
+                    continue
+                elif ctype == C_GOTO or ctype == C_IF:
+                    # like CodeWriter.writeGoto, a dotted name is a function
+                    if ctype == C_GOTO and "." in arg1:
+                        target = functions.get(arg1)
+                    else:
+                        target = labels.get((function, arg1))
+                    if target is None:
+                        raise ValueError(f"{file_name}: unknown label {arg1}")
+                    if ctype == C_GOTO and target == len(ops):
+                        emit(HALT)  # goto itself: the program has stopped
+                    else:
+                        emit(GOTO if ctype == C_GOTO else IF, target)
+                elif ctype == C_FUNCTION:
+                    function = arg1
+                    emit(FUNCTION, arg2)
+                elif ctype == C_CALL:
+                    emit_call(arg1, arg2)
+                elif ctype == C_RETURN:
+                    emit(RETURN)
+        emit(HALT)  # running off the end
+
+        self.ops, self.arg1s, self.arg2s, self.native_fns = ops, arg1s, arg2s, natives
+        self.functions = functions
+        self.statics = statics
+        self.reset()
+
+    def load_files(self, vm_files):
+        """
+        Loads .vm files in the order VMTranslator translates them.
+        """
+        self.load([
+            (os.path.splitext(os.path.basename(vm_file))[0], list(Parser(vm_file).commands()))
+            for vm_file in sorted(vm_files)
+        ])
+
+    def reset(self):
+        """
+        Restarts the program. RAM is left alone, like the hardware
+        reset. The native heap starts empty.
+        """
+        self.pc = 0
+        self.halted = False
+        self.steps = 0
+        self.heap_top = HEAP
+        self.free_blocks = {}
+
+    def run(self, max_steps=10_000_000):
+        """
+        Executes until the program halts (Sys.halt, a goto to itself, the
+        end of the code or a return to nowhere) or max_steps commands
+        have run. Returns the number of commands executed.
+        """
+        ops, arg1s, arg2s, native_fns = self.ops, self.arg1s, self.arg2s, self.native_fns
+        ram = self.ram
+        SP, LCL, ARG = ram[0], ram[1], ram[2]
+        pc = self.pc
+        n = 0
+        while n < max_steps:
+            op = ops[pc]
+            n += 1
+            if op == PUSH_CONST:
+                ram[SP] = arg1s[pc]
+                SP += 1
+            elif op == PUSH_LOCAL:
+                ram[SP] = ram[LCL + arg1s[pc]]
+                SP += 1
+            elif op == PUSH_ARG:
+                ram[SP] = ram[ARG + arg1s[pc]]
+                SP += 1
+            elif op == PUSH_THIS:
+                ram[SP] = ram[ram[3] + arg1s[pc]]
+                SP += 1
+            elif op == PUSH_THAT:
+                ram[SP] = ram[ram[4] + arg1s[pc]]
+                SP += 1
+            elif op == PUSH_RAM:
+                ram[SP] = ram[arg1s[pc]]
+                SP += 1
+            elif op <= POP_RAM:
+                SP -= 1
+                if op == POP_LOCAL:
+                    ram[LCL + arg1s[pc]] = ram[SP]
+                elif op == POP_ARG:
+                    ram[ARG + arg1s[pc]] = ram[SP]
+                elif op == POP_THIS:
+                    ram[ram[3] + arg1s[pc]] = ram[SP]
+                elif op == POP_THAT:
+                    ram[ram[4] + arg1s[pc]] = ram[SP]
+                else:
+                    ram[arg1s[pc]] = ram[SP]
+            elif op <= NOT:
+                if op == NEG:
+                    ram[SP - 1] = to_word(-ram[SP - 1])
+                elif op == NOT:
+                    ram[SP - 1] = ~ram[SP - 1]
+                else:
+                    SP -= 1
+                    x, y = ram[SP - 1], ram[SP]
+                    if op == ADD:
+                        value = x + y
+                        if value > 32767 or value < -32768:
+                            value = to_word(value)
+                    elif op == SUB:
+                        value = x - y
+                        if value > 32767 or value < -32768:
+                            value = to_word(value)
+                    elif op == EQ:
+                        value = -(x == y)
+                    elif op == GT:
+                        value = -(x > y)
+                    elif op == LT:
+                        value = -(x < y)
+                    elif op == AND:
+                        value = x & y
+                    else:
+                        value = x | y
+                    ram[SP - 1] = value
+            elif op == IF:
+                SP -= 1
+                if ram[SP]:
+                    pc = arg1s[pc]
+                    continue
+            elif op == GOTO:
+                pc = arg1s[pc]
+                continue
+            elif op == FUNCTION:
+                for _ in range(arg1s[pc]):
+                    ram[SP] = 0
+                    SP += 1
+            elif op == CALL or op == NATIVE:
+                n_args = arg2s[pc]
+                if op == NATIVE:
+                    result = native_fns[pc](self, *ram[SP - n_args:SP])
+                    if result is not None:
+                        SP -= n_args
+                        ram[SP] = result
+                        SP += 1
+                        pc += 1
+                        continue
+                    if arg1s[pc] < 0:
+                        raise ValueError(f"native call at {pc} declined, no VM function to fall back on")
+                ram[SP] = pc + 1
+                ram[SP + 1] = LCL
+                ram[SP + 2] = ARG
+                ram[SP + 3] = ram[3]
+                ram[SP + 4] = ram[4]
+                ARG = SP - n_args
+                SP += 5
+                LCL = SP
+                pc = arg1s[pc]
+                continue
+            elif op == RETURN:
+                frame = LCL
+                ret = ram[frame - 5]  # read first: with no arguments, ARG points at it
+                ram[ARG] = ram[SP - 1]
+                SP = ARG + 1
+                ram[4] = ram[frame - 1]
+                ram[3] = ram[frame - 2]
+                ARG = ram[frame - 3]
+                LCL = ram[frame - 4]
+                if not 0 <= ret < len(ops):
+                    # a return with no call to go back to (a test's made-up frame)
+                    self.halted = True
+                    break
+                pc = ret
+                continue
+            elif op == BOOT:
+                SP = STACK
+            else:
+                # HALT
+                n -= 1
+                self.halted = True
+                break
+            pc += 1
+
+        ram[0], ram[1], ram[2] = SP, LCL, ARG
+        self.pc = pc
+        self.steps += n
+        return n
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if arg != "--no-native"]
+    if len(args) not in (1, 2):
+        print("Usage: python3 VMEmulator.py [--no-native] <file.vm|directory> [max_steps]")
+        return
+
+    path = args[0]
+    if os.path.isdir(path):
+        vm_files = [os.path.join(path, f) for f in os.listdir(path) if f.endswith(".vm")]
+    else:
+        vm_files = [path]
+    vm = VMEmulator(natives="--no-native" not in sys.argv)
+    vm.load_files(vm_files)
+    max_steps = int(args[1]) if len(args) == 2 else 10_000_000
+
+    start = time.perf_counter()
+    steps = vm.run(max_steps)
+    seconds = time.perf_counter() - start
+
+    state = "halted" if vm.halted else "step budget exhausted"
+    print(f"{os.path.basename(path.rstrip('/'))}: {state} after {steps} commands "
+          f"({steps / max(seconds, 1e-9) / 1e6:.2f} M/s, {seconds * 1000:.1f} ms)")
+    print("RAM[0..15]:", list(vm.ram[:16]))
+
+
+if __name__ == "__main__":
+    main()
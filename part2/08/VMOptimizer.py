@@ -0,0 +1,182 @@
+"""
+VMOptimizer.py
+
+Optimization passes over the VM commands, before CodeWriter.
+The intermediate representation is the Parser's own: a list of
+(command type, arg1, arg2) tuples.
+
+- Constant folding: arithmetic and comparisons on constants become one
+  constant; an if-goto on a constant becomes a goto or disappears.
+- Dead code elimination: commands after a goto or return are removed up
+  to the next label that is jumped to, unused labels are dropped, and so
+  is a goto to the label right after it.
+- Dead function elimination: over the whole program, only functions
+  reachable from Sys.init through calls are kept.
+"""
+from CommandType import *
+
+CONST = "const"  # a folded constant: (CONST, value, None), any 16-bit value
+
+BINARY = {
+    "add": lambda x, y: x + y,
+    "sub": lambda x, y: x - y,
+    "and": lambda x, y: x & y,
+    "or": lambda x, y: x | y,
+    "eq": lambda x, y: -(x == y),
+    "gt": lambda x, y: -(x > y),
+    "lt": lambda x, y: -(x < y),
+}
+UNARY = {
+    "neg": lambda x: -x,
+    "not": lambda x: ~x,
+}
+
+
+def to_word(value):
+    """
+    value wrapped to a signed 16-bit word.
+    """
+    value &= 0xFFFF
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def _push(value):
+    """
+    Commands that push value ("push constant" only takes 0..32767).
+    """
+    if value >= 0:
+        return [(C_PUSH, "constant", value)]
+    if value == -32768:
+        return [(C_PUSH, "constant", 32767), (C_ARITHMETIC, "not", None)]
+    return [(C_PUSH, "constant", -value), (C_ARITHMETIC, "neg", None)]
+
+
+def fold_constants(commands):
+    """
+    Folds arithmetic whose operands were pushed as constants right
+    before it. A label, call or anything else in between stops folding,
+    since the stack there may come from elsewhere.
+    """
+    out = []
+    for command in commands:
+        ctype, arg1, arg2 = command
+        if ctype == C_PUSH and arg1 == "constant" and arg2 is not None:
+            out.append((CONST, arg2, None))
+            continue
+        if ctype == C_ARITHMETIC:
+            if arg1 in UNARY and out and out[-1][0] == CONST:
+                out[-1] = (CONST, to_word(UNARY[arg1](out[-1][1])), None)
+                continue
+            if arg1 in BINARY and len(out) >= 2 and out[-1][0] == out[-2][0] == CONST:
+                y = out.pop()[1]
+                x = out.pop()[1]
+                out.append((CONST, to_word(BINARY[arg1](x, y)), None))
+                continue
+        if ctype == C_IF and out and out[-1][0] == CONST:
+            if out.pop()[1]:
+                out.append((C_GOTO, arg1, None))
+            continue
+        out.append(command)
+
+    result = []
+    for command in out:
+        if command[0] == CONST:
+            result += _push(command[1])
+        else:
+            result.append(command)
+    return result
+
+
+def _jump_targets(commands):
+    """
+    (function, label) of every goto and if-goto target.
+    """
+    targets = set()
+    function = None
+    for ctype, arg1, _ in commands:
+        if ctype == C_FUNCTION:
+            function = arg1
+        elif ctype in (C_GOTO, C_IF):
+            targets.add((function, arg1))
+    return targets
+
+
+def remove_dead_code(commands):
+    """
+    One dead code pass; returns the new command list.
+    """
+    targets = _jump_targets(commands)
+    out = []
+    live = True
+    function = None
+    for command in commands:
+        ctype, arg1, _ = command
+        if ctype == C_FUNCTION:
+            function = arg1
+            live = True
+        elif ctype == C_LABEL:
+            if (function, arg1) not in targets:
+                continue
+            live = True
+            # goto L / label L: fall through instead
+            if out and out[-1] == (C_GOTO, arg1, None):
+                out.pop()
+        if live:
+            out.append(command)
+            if ctype in (C_GOTO, C_RETURN):
+                live = False
+    return out
+
+
+def optimize(commands):
+    """
+    Runs the passes until nothing changes. Returns the command list.
+    """
+    while True:
+        optimized = remove_dead_code(fold_constants(commands))
+        if optimized == commands:
+            return commands
+        commands = optimized
+
+
+def call_graph(program):
+    """
+    Maps every function of program (one command list per file) to the
+    set of functions it calls.
+    """
+    graph = {}
+    callees = None
+    for commands in program:
+        for ctype, arg1, _ in commands:
+            if ctype == C_FUNCTION:
+                callees = graph.setdefault(arg1, set())
+            elif ctype == C_CALL and callees is not None:
+                callees.add(arg1)
+    return graph
+
+
+def reachable(graph, entry="Sys.init"):
+    """
+    The functions entry calls, directly or indirectly, and entry itself.
+    """
+    seen = {entry}
+    todo = [entry]
+    while todo:
+        for callee in graph.get(todo.pop(), ()):
+            if callee not in seen:
+                seen.add(callee)
+                todo.append(callee)
+    return seen
+
+
+def keep_functions(commands, functions):
+    """
+    Yields commands without the functions not in functions. Commands
+    before the first function of a file are kept.
+    """
+    keep = True
+    for command in commands:
+        if command[0] == C_FUNCTION:
+            keep = command[1] in functions
+        if keep:
+            yield command
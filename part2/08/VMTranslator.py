@@ -1,22 +1,346 @@
 import sys
 import os
+import re
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from Parser import *
 from CodeWriter import *
 from CommandType import *
+from Fusion import C_FUSED, fuse
+import VMOptimizer
 
 
-def main():
-    # Check command line arguments
-    if len(sys.argv) != 2:
-        print("Usage: python3 VMTranslator.py <file.vm|directory>")
-        return
+FLAGS = {
+    "-O": "run the peephole optimizer on the generated assembly",
+    "-S": "use one shared call routine and one shared return routine",
+    "-C": "use one shared routine per eq/gt/lt comparison",
+    "-F": "fuse common command sequences into superinstructions",
+    "-D": "keep the top of the stack in the D register between commands",
+    "--fold": "fold constant expressions and remove dead VM code",
+    "--prune": "translate only the functions reachable from Sys.init",
+    "-j": "translate the .vm files in parallel (same output)",
+    "--cache": "reuse translations of unchanged files from .vmcache",
+    "--stream": "decode .vm lines lazily as they are translated (not with -j or --cache)",
+    "--size-report": "translate with and without -S and compare ROM sizes",
+}
+
+# code generation flags -> translate() keyword arguments
+OPTION_FLAGS = {
+    "-O": "optimize",
+    "-S": "shared_calls",
+    "-C": "shared_compare",
+    "-F": "fuse",
+    "-D": "cache_top",
+    "--fold": "fold",
+    "--prune": "prune",
+}
+
+
+def options_from_flags(flags):
+    """
+    translate() options for the given command line flags.
+    """
+    return {option: flag in flags for flag, option in OPTION_FLAGS.items()}
+
+
+def translate_file(vm_file, codewriter, streaming=False, functions=None):
+    """
+    Parses one .vm file and feeds its commands to codewriter.
+    With streaming, lines are decoded lazily as the writer consumes them
+    (folding needs the whole file, so it reads it in first).
+    If functions is given, only those functions are translated.
+    """
+    if streaming:
+        commands = stream_commands(vm_file)
+    else:
+        commands = Parser(vm_file).commands()
+    if codewriter.fold:
+        commands = VMOptimizer.optimize(list(commands))
+    if functions is not None:
+        commands = VMOptimizer.keep_functions(commands, functions)
+    if codewriter.fusion_patterns:
+        commands = fuse(commands, codewriter.fusion_patterns)
+    codewriter.setFileName(vm_file)
+
+    for command_type, arg1, arg2 in commands:
+
+        if command_type == C_ARITHMETIC:
+            codewriter.writeArithmetic(arg1)
+        
+        elif command_type == C_PUSH or command_type == C_POP:
+            codewriter.writePushPop(command_type, arg1, arg2)
+        
+        elif command_type == C_LABEL:
+            codewriter.writeLabel(arg1)
+        
+        elif command_type == C_GOTO:
+            codewriter.writeGoto(arg1)
+        
+        elif command_type == C_IF:
+            codewriter.writeIf(arg1)
+        
+        elif command_type == C_FUNCTION:
+            codewriter.writeFunction(arg1, arg2)
+        
+        elif command_type == C_CALL:
+            codewriter.writeCall(arg1, arg2)
+        
+        elif command_type == C_RETURN:
+            codewriter.writeReturn()
 
-    input_path = sys.argv[1]
+        elif command_type == C_FUSED:
+            codewriter.writeFused(arg1, arg2)
+
+
+def live_functions(vm_files, fold=False):
+    """
+    Whole-program call graph: returns the functions reachable from
+    Sys.init, or None if there is no Sys.init to start from. With fold,
+    calls in code that folding removes do not count.
+    """
+    program = []
+    for vm_file in vm_files:
+        commands = list(Parser(vm_file).commands())
+        program.append(VMOptimizer.optimize(commands) if fold else commands)
+    graph = VMOptimizer.call_graph(program)
+    if "Sys.init" not in graph:
+        return None
+    functions = VMOptimizer.reachable(graph)
+    print(f"Reachable from Sys.init: {len(functions & graph.keys())} of {len(graph)} functions")
+    return functions
+
+
+def translate(vm_files, output_file, streaming=False, prune=False, **options):
+    """
+    Translates vm_files into one .asm file and returns the CodeWriter.
+    options are passed on to CodeWriter. With streaming, memory use does
+    not depend on the input size (unless optimize buffers the output).
+    With prune, unreachable functions are left out.
+    """
+    functions = live_functions(vm_files, options.get("fold", False)) if prune else None
+    codewriter = CodeWriter(output_file, **options)
     
+    # Add bootstrap code (always needed for Project 8)
+    if any('Sys.vm' in file for file in vm_files):
+        codewriter.writeInit()
+
+    # Process all VM files
+    for vm_file in sorted(vm_files):
+        print(f"Processing: {vm_file}")
+        translate_file(vm_file, codewriter, streaming, functions)
+
+    # Close the output file
+    codewriter.close()
+    return codewriter
+
+
+# label number written by a CodeWriter in fragment mode
+LABEL_ID = re.compile(r"\x00(\d+)\x00")
+
+
+def translate_fragment(vm_file, options, functions=None):
+    """
+    Worker for translate_parallel: translates one file in memory.
+    Returns (assembly, labels used, shared routines used). Label numbers
+    start at 0 and are marked so the merge can shift them.
+    """
+    options = dict(options, optimize=False)  # the merged stream is optimized once
+    chunks = []
+    codewriter = CodeWriter(chunks, **options)
+    codewriter.fragment = True
+    translate_file(vm_file, codewriter, functions=functions)
+    codewriter.spillTop()  # as setFileName or close would in the serial stream
+    return "".join(chunks), codewriter.label_counter, codewriter.used_routines
+
+
+def merge_fragments(vm_files, output_file, fragments, **options):
+    """
+    Writes bootstrap code and the fragments of vm_files (in that order)
+    to output_file, shifting each fragment's label numbers by the labels
+    used before it. Returns the CodeWriter.
+    """
+    codewriter = CodeWriter(output_file, **options)
+    if any('Sys.vm' in file for file in vm_files):
+        codewriter.writeInit()
+
+    for vm_file, (asm, labels, routines) in zip(vm_files, fragments):
+        print(f"Processing: {vm_file}")
+        offset = codewriter.label_counter
+        codewriter.write(LABEL_ID.sub(lambda m: str(int(m.group(1)) + offset), asm))
+        codewriter.label_counter += labels
+        codewriter.used_routines |= set(routines)
+
+    codewriter.close()
+    return codewriter
+
+
+def translate_parallel(vm_files, output_file, workers=None, prune=False, **options):
+    """
+    Same output as translate(), byte for byte, with each .vm file
+    translated in its own worker process. Fragments are merged in sorted
+    file order and their label numbers shifted by the labels used before
+    them, so numbering matches the serial translator. Static names are
+    already scoped by file name.
+
+    Like the serial translator, a file is expected to start with a
+    function command: labels before it are scoped to no function.
+    """
+    vm_files = sorted(vm_files)
+    functions = live_functions(vm_files, options.get("fold", False)) if prune else None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        fragments = pool.map(translate_fragment, vm_files, [options] * len(vm_files), [functions] * len(vm_files))
+        return merge_fragments(vm_files, output_file, fragments, **options)
+
+
+# translator sources; a change to any of them invalidates the cache
+# (Peephole.py only runs on the merged stream, which is never cached)
+TRANSLATOR_SOURCES = ["CommandType.py", "Parser.py", "CodeWriter.py", "Sink.py", "Fusion.py",
+                      "VMOptimizer.py", "VMTranslator.py"]
+CACHE_DIR = ".vmcache"
+
+
+def translator_version():
+    """
+    Hash of the translator's own source files.
+    """
+    digest = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in TRANSLATOR_SOURCES:
+        with open(os.path.join(here, name), "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def fragment_key(vm_file, options, version, functions=None):
+    """
+    Cache key of one file: its contents and name, the options that
+    change its fragment, the functions kept when pruning, and the
+    translator version.
+    """
+    digest = hashlib.sha256(version.encode())
+    digest.update(os.path.basename(vm_file).encode())
+    digest.update(repr(sorted(dict(options, optimize=False).items())).encode())
+    if functions is not None:
+        digest.update(repr(sorted(functions)).encode())
+    with open(vm_file, "rb") as file:
+        digest.update(file.read())
+    return digest.hexdigest()
+
+
+def cache_slot(vm_file, options, version):
+    """
+    Cache entry name prefix shared by every version of one file's
+    fragment under the same translator and options. A new entry
+    supersedes the others in its slot.
+    """
+    digest = hashlib.sha256(os.path.basename(vm_file).encode())
+    digest.update(repr(sorted(dict(options, optimize=False).items())).encode())
+    return f"{version[:12]}-{digest.hexdigest()[:16]}-"
+
+
+def prune_cache(cache_dir, version):
+    """
+    Removes the entries written by other translator versions.
+    """
+    for name in os.listdir(cache_dir):
+        if name.endswith(".json") and not name.startswith(version[:12] + "-"):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
+
+
+def translate_cached(vm_files, output_file, cache_dir=None, parallel=False, prune=False, **options):
+    """
+    Same output as translate(), reusing the fragments of unchanged files
+    from an on-disk cache (cache_dir, by default .vmcache next to the
+    output). Fragments carry relative label numbers, so cached and fresh
+    ones merge without collisions. Misses are translated in a process
+    pool when parallel is set. Entries of older translator versions and
+    superseded entries of the same file and options are removed, so the
+    cache holds at most one entry per file and option set.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(output_file)), CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    vm_files = sorted(vm_files)
+    version = translator_version()
+    prune_cache(cache_dir, version)
+    functions = live_functions(vm_files, options.get("fold", False)) if prune else None
+    slots = [cache_slot(f, options, version) for f in vm_files]
+    paths = [os.path.join(cache_dir, slot + fragment_key(f, options, version, functions) + ".json")
+             for slot, f in zip(slots, vm_files)]
+
+    fragments = []
+    for path in paths:
+        try:
+            with open(path) as file:
+                entry = json.load(file)
+            fragments.append((entry["asm"], entry["labels"], entry["routines"]))
+        except (OSError, ValueError, KeyError):
+            fragments.append(None)
+
+    misses = [i for i, fragment in enumerate(fragments) if fragment is None]
+    todo = [vm_files[i] for i in misses]
+    if parallel and len(todo) > 1:
+        with ProcessPoolExecutor() as pool:
+            fresh = list(pool.map(translate_fragment, todo, [options] * len(todo), [functions] * len(todo)))
+    else:
+        fresh = [translate_fragment(vm_file, options, functions) for vm_file in todo]
+
+    for i, (asm, labels, routines) in zip(misses, fresh):
+        fragments[i] = (asm, labels, sorted(routines))
+        # write then rename, so a concurrent run never reads half an entry
+        tmp_path = paths[i] + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"asm": asm, "labels": labels, "routines": sorted(routines)}, file)
+        os.replace(tmp_path, paths[i])
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if name.startswith(slots[i]) and name.endswith(".json") and path != paths[i]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    print(f"Cache: {len(vm_files) - len(misses)} reused, {len(misses)} translated")
+    return merge_fragments(vm_files, output_file, fragments, **options)
+
+
+def rom_size(asm_file):
+    """
+    Counts the ROM words of an .asm file (labels and comments excluded).
+    """
+    with open(asm_file) as file:
+        lines = [line.split("//")[0].strip() for line in file]
+    return sum(1 for line in lines if line and not line.startswith("("))
+
+
+def size_report(vm_files, output_file, **options):
+    """
+    Prints ROM size with inlined and with shared call/return code.
+    """
+    sizes = {}
+    for shared_calls in (False, True):
+        translate(vm_files, output_file, **dict(options, shared_calls=shared_calls))
+        sizes[shared_calls] = rom_size(output_file)
+    inline, shared = sizes[False], sizes[True]
+    print(f"ROM size inline calls: {inline} words")
+    print(f"ROM size shared calls: {shared} words ({inline - shared} saved, "
+          f"{100 * (inline - shared) / inline:.1f}%)")
+
+
+def find_vm_files(input_path):
+    """
+    Returns (.vm files, output .asm path) for a .vm file or a directory,
+    or None (after printing why) if there is nothing to translate.
+    """
     # Check if input exists
     if not os.path.exists(input_path):
         print(f"Error: {input_path} not found!")
-        return
+        return None
 
     # Determine if single file or directory
     if os.path.isfile(input_path) and input_path.endswith('.vm'):
@@ -24,67 +348,58 @@ def main():
         vm_files = [input_path]
         input_basename = os.path.basename(input_path)
         output_file = os.path.splitext(input_basename)[0] + ".asm"
-        
+    
     elif os.path.isdir(input_path):
         # Directory mode
         vm_files = [os.path.join(input_path, f) for f in os.listdir(input_path) if f.endswith('.vm')]
         if not vm_files:
             print(f"No .vm files found in directory: {input_path}")
-            return
+            return None
         # Output file named after directory, saved in same test directory
         dir_name = os.path.basename(input_path.rstrip('/\\'))
         output_file = os.path.join(input_path, dir_name + ".asm")
-        
+    
     else:
         print("Error: Input must be a .vm file or directory containing .vm files")
-        return
+        return None
 
-    print(f"Output: {output_file}")
+    return vm_files, output_file
 
-    # Initialize code writer
-    codewriter = CodeWriter(output_file)
+
+def main():
+    # Check command line arguments
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("-")]
+    flags = [arg for arg in sys.argv[1:] if arg.startswith("-")]
+    # -j and --cache parse whole files into fragments, they cannot stream
+    streams_fragments = "--stream" in flags and ("-j" in flags or "--cache" in flags)
+    if len(args) != 1 or any(flag not in FLAGS for flag in flags) or streams_fragments:
+        print("Usage: python3 VMTranslator.py [options] <file.vm|directory>")
+        for flag, text in FLAGS.items():
+            print(f"  {flag:<14} {text}")
+        return
+
+    input_path = args[0]
+    options = options_from_flags(flags)
     
-    # Add bootstrap code (always needed for Project 8)
-    if any('Sys.vm' in file for file in vm_files):
-        codewriter.writeInit()
+    found = find_vm_files(input_path)
+    if found is None:
+        return
+    vm_files, output_file = found
 
-    # Process all VM files
-    for vm_file in sorted(vm_files):
-        print(f"Processing: {vm_file}")
-        
-        parser = Parser(vm_file)
-        codewriter.setFileName(vm_file)
-
-        while parser.hasMoreLines():
-            parser.advance()
-            command_type = parser.commandType()
-
-            if command_type == C_ARITHMETIC:
-                codewriter.writeArithmetic(parser.arg1())
-            
-            elif command_type == C_PUSH or command_type == C_POP:
-                codewriter.writePushPop(command_type, parser.arg1(), parser.arg2())
-            
-            elif command_type == C_LABEL:
-                codewriter.writeLabel(parser.arg1())
-            
-            elif command_type == C_GOTO:
-                codewriter.writeGoto(parser.arg1())
-            
-            elif command_type == C_IF:
-                codewriter.writeIf(parser.arg1())
-            
-            elif command_type == C_FUNCTION:
-                codewriter.writeFunction(parser.arg1(), parser.arg2())
-            
-            elif command_type == C_CALL:
-                codewriter.writeCall(parser.arg1(), parser.arg2())
-            
-            elif command_type == C_RETURN:
-                codewriter.writeReturn()
+    print(f"Output: {output_file}")
 
-    # Close the output file
-    codewriter.close()
+    if "--size-report" in flags:
+        # Leaves the output file in -S mode
+        size_report(vm_files, output_file, **options)
+    else:
+        if "--cache" in flags:
+            codewriter = translate_cached(vm_files, output_file, parallel="-j" in flags, **options)
+        elif "-j" in flags:
+            codewriter = translate_parallel(vm_files, output_file, **options)
+        else:
+            codewriter = translate(vm_files, output_file, streaming="--stream" in flags, **options)
+        if codewriter.peephole:
+            print(codewriter.peephole.report())
     print("Translation complete!")
 
 if __name__ == "__main__":
@@ -1,45 +1,149 @@
 import re
-from typing import List, Tuple
+import mmap
+from typing import Iterator, Optional, Tuple
+
+KEYWORDS = frozenset([
+    "class", "constructor", "function", "method", "field", "static", "var",
+    "int", "char", "boolean", "void", "true", "false", "null", "this",
+    "let", "do", "if", "else", "while", "return",
+])
+SYMBOLS = "{}()[].,;+-*/&|<>=~"
 
 class JackTokenizer:
     """
-    Simple Jack Tokenizer: turns Jack source into (type, value) pairs
+    Simple Jack Tokenizer: turns Jack source into (type, value) pairs.
+    Tokens are produced lazily, one ahead of the parser, and each knows
+    its line and column.
     """
 
-    token_specification = [
-        ("keyword", r"\b(class|constructor|function|method|field|static|var|int|char|boolean|void|true|false|null|this|let|do|if|else|while|return)\b"),
-        ("symbol", r"[{}()\[\].,;+\-*/&|<>=~]"),
-        ("integerConstant", r"\d+"),
-        ("stringConstant", r"\".*?\""),
-        ("identifier", r"[A-Za-z_]\w*"),
-        ("skip", r"\s+|//.*|/\*.*?\*/"),
-    ]
+    # Compiled once. Alternatives in order of frequency: whitespace and
+    # comments (a whole run of them in one match), then symbols, words,
+    # numbers, strings. A word is a keyword if it is in KEYWORDS, which
+    # is cheaper than a \b(...)\b alternative.
+    token_regex = re.compile(r"""
+        (?P<skip>(?:\s+|//[^\n]*|/\*.*?\*/)+)
+      | (?P<symbol>[{}()\[\].,;+\-*/&|<>=~])
+      | (?P<identifier>[A-Za-z_]\w*)
+      | (?P<integerConstant>\d+)
+      | (?P<stringConstant>"[^"\n]*")
+    """, re.DOTALL | re.VERBOSE)
 
     def __init__(self, source: str):
-        self.tokens: List[Tuple[str, str]] = self.tokenize(source)
-        self.current = 0
-
-    def tokenize(self, text: str) -> List[Tuple[str, str]]:
-        pattern = "|".join(f"(?P<{name}>{regex})" for name, regex in self.token_specification)
-        regex = re.compile(pattern, re.DOTALL)
-        tokens = []
-        for match in regex.finditer(text):
+        self.tokens = self.tokenize(source)
+        self.next: Optional[Tuple[str, str, int, int]] = next(self.tokens, None)
+        self.line = 0    # position of the token last returned by advance()
+        self.column = 0
+
+    def tokenize(self, text: str) -> Iterator[Tuple[str, str, int, int]]:
+        """
+        Yields (type, value, line, column) for each token of text.
+        Characters that start no token are skipped.
+        """
+        line, line_start = 1, 0
+        for match in self.token_regex.finditer(text):
             kind = match.lastgroup
-            value = match.group()
+            start = match.start()
             if kind == "skip":
+                newlines = text.count("\n", start, match.end())
+                if newlines:
+                    line += newlines
+                    line_start = text.rfind("\n", start, match.end()) + 1
                 continue
-            tokens.append((kind, value))
-        return tokens
+            value = match.group()
+            if kind == "identifier" and value in KEYWORDS:
+                kind = "keyword"
+            yield kind, value, line, start - line_start + 1
 
     def has_more_tokens(self) -> bool:
-        return self.current < len(self.tokens)
+        return self.next is not None
 
     def advance(self) -> Tuple[str, str]:
-        tok = self.tokens[self.current]
-        self.current += 1
-        return tok
+        if self.next is None:
+            raise IndexError("no more tokens")
+        kind, value, self.line, self.column = self.next
+        self.next = next(self.tokens, None)
+        return kind, value
 
     def peek(self) -> Tuple[str, str]:
-        if self.has_more_tokens():
-            return self.tokens[self.current]
+        if self.next is not None:
+            return self.next[:2]
         return ("", "")
+
+
+class MappedJackTokenizer(JackTokenizer):
+    """
+    JackTokenizer over a memory-mapped .jack file, for very large
+    sources. The bytes are matched in place: a token is (type, start,
+    end) offsets into the buffer, and its text is decoded only when
+    advance() or peek() hands it to the parser. Positions are computed
+    on demand too.
+    """
+
+    # Same alternatives as JackTokenizer.token_regex. Keywords get their
+    # own alternative, since telling them apart afterwards needs the text.
+    token_regex = re.compile(rb"""
+        (?P<skip>(?:\s+|//[^\n]*|/\*.*?\*/)+)
+      | (?P<symbol>[{}()\[\].,;+\-*/&|<>=~])
+      | (?P<keyword>(?:class|constructor|function|method|field|static|var|int|char|boolean
+                    |void|true|false|null|this|let|do|if|else|while|return)(?!\w))
+      | (?P<identifier>[A-Za-z_]\w*)
+      | (?P<integerConstant>\d+)
+      | (?P<stringConstant>"[^"\n]*")
+    """, re.DOTALL | re.VERBOSE)
+
+    symbol_text = {ord(symbol): symbol for symbol in SYMBOLS}
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            # an empty file cannot be mapped
+            size = f.seek(0, 2)
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.tokens = self.tokenize(self.buffer)
+        self.next: Optional[Tuple[str, int, int]] = next(self.tokens, None)
+        self.next_text: Optional[str] = None
+        self.start = 0  # offset of the token last returned by advance()
+
+    def tokenize(self, buffer) -> Iterator[Tuple[str, int, int]]:
+        """
+        Yields (type, start, end) for each token of buffer.
+        """
+        for match in self.token_regex.finditer(buffer):
+            kind = match.lastgroup
+            if kind != "skip":
+                yield kind, match.start(), match.end()
+
+    def text(self, token: Tuple[str, int, int]) -> str:
+        kind, start, end = token
+        if kind == "symbol":
+            return self.symbol_text[self.buffer[start]]
+        return self.buffer[start:end].decode()
+
+    def advance(self) -> Tuple[str, str]:
+        if self.next is None:
+            raise IndexError("no more tokens")
+        kind, self.start, _ = self.next
+        text = self.next_text if self.next_text is not None else self.text(self.next)
+        self.next = next(self.tokens, None)
+        self.next_text = None
+        return kind, text
+
+    def peek(self) -> Tuple[str, str]:
+        if self.next is None:
+            return ("", "")
+        if self.next_text is None:
+            self.next_text = self.text(self.next)
+        return self.next[0], self.next_text
+
+    @property
+    def line(self) -> int:
+        return self.buffer[:self.start].count(b"\n") + 1
+
+    @property
+    def column(self) -> int:
+        return self.start - (self.buffer.rfind(b"\n", 0, self.start) + 1) + 1
+
+    def close(self):
+        # the generator's scanner holds the buffer until it is closed
+        self.tokens.close()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
@@ -1,16 +1,23 @@
 import sys
 import os
-from JackTokenizer import JackTokenizer
+from JackTokenizer import JackTokenizer, MappedJackTokenizer
 from CompilationEngine import CompilationEngine
 
-def compile_file(file_path: str):
-    # Read input Jack file
-    with open(file_path, "r") as f:
-        jack_code = f.read()
-
-    tokenizer = JackTokenizer(jack_code)
+def compile_file(file_path: str, mapped: bool = False):
+    if mapped:
+        # Tokenize the memory-mapped bytes in place
+        tokenizer = MappedJackTokenizer(file_path)
+    else:
+        # Read input Jack file
+        with open(file_path, "r") as f:
+            jack_code = f.read()
+        tokenizer = JackTokenizer(jack_code)
     compiler = CompilationEngine(tokenizer)
-    compiler.compile_class()
+    try:
+        compiler.compile_class()
+    finally:
+        if mapped:
+            tokenizer.close()
 
     # Output file (replace .jack with .xml)
     output_path = file_path.replace(".jack", ".xml")
@@ -20,11 +27,14 @@ def compile_file(file_path: str):
     print(f"✅ Compiled: {os.path.basename(file_path)} → {os.path.basename(output_path)}")
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python main.py <input_file.jack>")
+    args = [arg for arg in sys.argv[1:] if arg != "--mmap"]
+    mapped = "--mmap" in sys.argv[1:]
+    if len(args) != 1:
+        print("Usage: python main.py [--mmap] <input_file.jack>")
+        print("  --mmap  tokenize the memory-mapped file, for very large sources")
         return
 
-    path = sys.argv[1]
+    path = args[0]
     if not os.path.exists(path):
         print("❌ File not found:", path)
         return
@@ -33,9 +43,9 @@ def main():
         # compile all .jack files in folder
         for filename in os.listdir(path):
             if filename.endswith(".jack"):
-                compile_file(os.path.join(path, filename))
+                compile_file(os.path.join(path, filename), mapped)
     else:
-        compile_file(path)
+        compile_file(path, mapped)
 
 if __name__ == "__main__":
     main()